@@ -0,0 +1,285 @@
+/*
+ * Optional C speedups for stacklogger.
+ *
+ * stacklogger uses these functions when this module can be imported and
+ * falls back to its pure Python versions otherwise. Each function here must
+ * return exactly what its Python counterpart returns.
+ */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <frameobject.h>
+
+#if PY_VERSION_HEX < 0x030900B1
+static PyCodeObject *
+PyFrame_GetCode(PyFrameObject *frame)
+{
+    Py_INCREF(frame->f_code);
+    return frame->f_code;
+}
+
+static PyFrameObject *
+PyFrame_GetBack(PyFrameObject *frame)
+{
+    Py_XINCREF(frame->f_back);
+    return frame->f_back;
+}
+#endif
+
+#if PY_VERSION_HEX < 0x030B0000
+static PyObject *
+PyCode_GetVarnames(PyCodeObject *code)
+{
+    Py_INCREF(code->co_varnames);
+    return code->co_varnames;
+}
+#endif
+
+static PyObject *skips_str, *class_str;
+
+PyDoc_STRVAR(walk_doc,
+"walk(frame, decisions, skip, stacklevel=1)\n\
+\n\
+Return the stacklevel-th frame from frame that isn't skipped.\n\
+\n\
+If there are fewer such frames, the last one is returned, or None if every\n\
+frame is skipped.\n\
+\n\
+decisions maps code filenames to True (skip) or False; skip.skips() is\n\
+called with frames whose filenames aren't in decisions.");
+
+static PyObject *
+walk(PyObject *module, PyObject *const *args, Py_ssize_t nargs)
+{
+    PyObject *decisions, *skip;
+    Py_ssize_t stacklevel = 1;
+    PyFrameObject *current, *last = NULL;
+
+    if (nargs < 3 || nargs > 4) {
+        PyErr_SetString(PyExc_TypeError,
+            "walk() takes from 3 to 4 positional arguments");
+        return NULL;
+    }
+    decisions = args[1];
+    skip = args[2];
+    if (!PyDict_Check(decisions)) {
+        PyErr_SetString(PyExc_TypeError, "walk() requires a dict");
+        return NULL;
+    }
+    if (nargs == 4) {
+        stacklevel = PyLong_AsSsize_t(args[3]);
+        if (stacklevel == -1 && PyErr_Occurred())
+            return NULL;
+    }
+    if (args[0] == Py_None)
+        Py_RETURN_NONE;
+    if (!PyFrame_Check(args[0])) {
+        PyErr_SetString(PyExc_TypeError, "walk() requires a frame");
+        return NULL;
+    }
+
+    current = (PyFrameObject *)args[0];
+    Py_INCREF(current);
+    while (current != NULL) {
+        PyCodeObject *code = PyFrame_GetCode(current);
+        PyObject *decision = PyDict_GetItemWithError(decisions,
+            code->co_filename);
+        PyFrameObject *back;
+        int skipped;
+
+        Py_DECREF(code);
+        if (decision == Py_False) {
+            skipped = 0;
+        }
+        else if (decision != NULL) {
+            skipped = PyObject_IsTrue(decision);
+        }
+        else if (PyErr_Occurred()) {
+            skipped = -1;
+        }
+        else {
+            PyObject *result = PyObject_CallMethodObjArgs(skip, skips_str,
+                (PyObject *)current, NULL);
+            if (result == NULL) {
+                skipped = -1;
+            }
+            else {
+                skipped = PyObject_IsTrue(result);
+                Py_DECREF(result);
+            }
+        }
+        if (skipped < 0) {
+            Py_DECREF(current);
+            Py_XDECREF(last);
+            return NULL;
+        }
+        if (!skipped) {
+            if (stacklevel <= 1) {
+                Py_XDECREF(last);
+                return (PyObject *)current;
+            }
+            stacklevel--;
+            Py_XDECREF(last);
+            Py_INCREF(current);
+            last = current;
+        }
+        back = PyFrame_GetBack(current);
+        Py_DECREF(current);
+        current = back;
+    }
+    if (last == NULL)
+        Py_RETURN_NONE;
+    return (PyObject *)last;
+}
+
+/*
+ * Return a new reference to the local variable called name at frame, or NULL.
+ * If it isn't set, *missing is set to one and no exception is raised. Python
+ * 3.12 and newer read the variable directly; older versions have to build
+ * frame.f_locals first.
+ */
+static PyObject *
+getvar(PyObject *frame, PyObject *name, int *missing)
+{
+    PyObject *value;
+
+    *missing = 0;
+#if PY_VERSION_HEX >= 0x030C0000
+    value = PyFrame_GetVar((PyFrameObject *)frame, name);
+    if (value == NULL && PyErr_ExceptionMatches(PyExc_NameError)) {
+        PyErr_Clear();
+        *missing = 1;
+    }
+#else
+    {
+#if PY_VERSION_HEX >= 0x030B0000
+        PyObject *locals = PyFrame_GetLocals((PyFrameObject *)frame);
+#else
+        PyObject *locals = PyObject_GetAttrString(frame, "f_locals");
+#endif
+        if (locals == NULL)
+            return NULL;
+        value = PyObject_GetItem(locals, name);
+        Py_DECREF(locals);
+        if (value == NULL && PyErr_ExceptionMatches(PyExc_KeyError)) {
+            PyErr_Clear();
+            *missing = 1;
+        }
+    }
+#endif
+    return value;
+}
+
+PyDoc_STRVAR(receiver_doc,
+"receiver(frame)\n\
+\n\
+Return the class of the first positional argument at frame, or None.\n\
+\n\
+If the argument is itself a class, it is returned. On Python 3.12 and\n\
+newer the argument is read directly, without building frame.f_locals.");
+
+static PyObject *
+receiver(PyObject *module, PyObject *frame)
+{
+    PyCodeObject *code;
+    PyObject *varnames, *name, *value, *cls;
+    int missing;
+
+    if (!PyFrame_Check(frame)) {
+        PyErr_SetString(PyExc_TypeError, "receiver() requires a frame");
+        return NULL;
+    }
+    code = PyFrame_GetCode((PyFrameObject *)frame);
+    if (code->co_argcount == 0) {
+        Py_DECREF(code);
+        Py_RETURN_NONE;
+    }
+    varnames = PyCode_GetVarnames(code);
+    Py_DECREF(code);
+    if (varnames == NULL)
+        return NULL;
+    name = PyTuple_GetItem(varnames, 0);
+    if (name == NULL) {
+        Py_DECREF(varnames);
+        return NULL;
+    }
+    value = getvar(frame, name, &missing);
+    Py_DECREF(varnames);
+    if (value == NULL) {
+        if (missing)
+            Py_RETURN_NONE;
+        return NULL;
+    }
+
+    if (PyType_Check(value))
+        return value;
+    cls = PyObject_GetAttr(value, class_str);
+    Py_DECREF(value);
+    return cls;
+}
+
+PyDoc_STRVAR(arguments_doc,
+"arguments(frame, names, missing)\n\
+\n\
+Return a tuple of the values of the local variables called names at frame.\n\
+\n\
+Variables that aren't set are returned as missing. On Python 3.12 and\n\
+newer the variables are read directly, without building frame.f_locals.");
+
+static PyObject *
+arguments(PyObject *module, PyObject *args)
+{
+    PyObject *frame, *names, *missing, *result;
+    Py_ssize_t i, n;
+
+    if (!PyArg_ParseTuple(args, "OO!O:arguments", &frame, &PyTuple_Type,
+            &names, &missing))
+        return NULL;
+    if (!PyFrame_Check(frame)) {
+        PyErr_SetString(PyExc_TypeError, "arguments() requires a frame");
+        return NULL;
+    }
+    n = PyTuple_GET_SIZE(names);
+    result = PyTuple_New(n);
+    if (result == NULL)
+        return NULL;
+    for (i = 0; i < n; i++) {
+        int unset;
+        PyObject *value = getvar(frame, PyTuple_GET_ITEM(names, i), &unset);
+        if (value == NULL) {
+            if (!unset) {
+                Py_DECREF(result);
+                return NULL;
+            }
+            Py_INCREF(missing);
+            value = missing;
+        }
+        PyTuple_SET_ITEM(result, i, value);
+    }
+    return result;
+}
+
+static PyMethodDef methods[] = {
+    {"walk", (PyCFunction)(void(*)(void))walk, METH_FASTCALL, walk_doc},
+    {"receiver", receiver, METH_O, receiver_doc},
+    {"arguments", arguments, METH_VARARGS, arguments_doc},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef module = {
+    PyModuleDef_HEAD_INIT,
+    "_stacklogger",
+    "Optional C speedups for stacklogger.",
+    -1,
+    methods
+};
+
+PyMODINIT_FUNC
+PyInit__stacklogger(void)
+{
+    skips_str = PyUnicode_InternFromString("skips");
+    class_str = PyUnicode_InternFromString("__class__");
+    if (skips_str == NULL || class_str == NULL)
+        return NULL;
+    return PyModule_Create(&module);
+}
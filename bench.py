@@ -0,0 +1,747 @@
+"""Benchmarks for stacklogger.
+
+Run the microbenchmarks with::
+
+    $ python bench.py
+
+Each microbenchmark prints the mean cost of a single operation in
+microseconds. The suite compares :class:`stacklogger.StackLogger` with the
+standard :class:`logging.Logger` across call site kinds, stack depths,
+handler configurations and thread counts, and can save its results to compare
+them across commits::
+
+    $ python bench.py suite -o before.json
+    $ python bench.py suite -o after.json
+    $ python bench.py compare before.json after.json
+"""
+
+import inspect
+import json
+import logging
+import logging.handlers
+import os
+import pickle
+import platform
+import subprocess
+import sys
+import threading
+import time
+import timeit
+import tracemalloc
+
+import stacklogger
+
+from stacklogger import StackLogger, FrontCache, JSONFormatter, LRUCache, \
+    RandomSampler, callingframe, classfunc, framefunc, receiver
+
+def deepen(depth, func, *args):
+    """Call *func* with *args* beneath *depth* extra stack frames."""
+    if depth <= 0:
+        return func(*args)
+    return deepen(depth - 1, func, *args)
+
+def report(name, seconds, number):
+    print("%-56s %10.2f us" % (name, seconds / number * 1e6))
+
+def bench_callingframe(depths=(0, 10, 50, 100, 200), number=2000):
+    """Compare the record-building and fast :func:`callingframe` modes."""
+    for depth in depths:
+        for fast in (False, True):
+            def run():
+                frame = inspect.currentframe()
+                for _ in range(number):
+                    callingframe(frame, fast=fast)
+            timer = timeit.Timer(lambda: deepen(depth, run))
+            name = "callingframe(fast=%s) depth=%d" % (fast, depth)
+            report(name, min(timer.repeat(3, 1)), number)
+
+def bench_record(depths=(0, 10, 50, 100, 200), number=2000):
+    """Measure the cost of emitting a record through a :class:`StackLogger`."""
+    for cls in (logging.Logger, StackLogger):
+        log = cls("bench")
+        log.propagate = False
+        log.addHandler(logging.NullHandler())
+        log.setLevel(logging.DEBUG)
+        for depth in depths:
+            def run():
+                for _ in range(number):
+                    log.debug("record")
+            timer = timeit.Timer(lambda: deepen(depth, run))
+            name = "%s.debug depth=%d" % (cls.__name__, depth)
+            report(name, min(timer.repeat(3, 1)), number)
+
+class Fake(object):
+
+    def method(self):
+        return inspect.currentframe()
+
+def bench_framefunc(number=20000):
+    """Compare cached :func:`framefunc` with uncached name resolution."""
+    frame = Fake().method()
+    saved, stacklogger.usequalname = stacklogger.usequalname, False
+    try:
+        timer = timeit.Timer(lambda: framefunc(frame))
+        report("framefunc (cached)", min(timer.repeat(3, number)), number)
+    finally:
+        stacklogger.usequalname = saved
+    timer = timeit.Timer(lambda: classfunc(frame.f_code, receiver(frame)))
+    report("framefunc (uncached)", min(timer.repeat(3, number)), number)
+
+def bench_resolvers(number=20000):
+    """Compare the co_qualname and instance-sniffing :func:`framefunc` resolvers."""
+    frame = Fake().method()
+    saved = stacklogger.usequalname
+    try:
+        for usequalname in (False, True):
+            if usequalname and not hasattr(frame.f_code, "co_qualname"):
+                continue
+            stacklogger.usequalname = usequalname
+            timer = timeit.Timer(lambda: framefunc(frame))
+            name = "framefunc (usequalname=%s)" % usequalname
+            report(name, min(timer.repeat(3, number)), number)
+    finally:
+        stacklogger.usequalname = saved
+
+def bench_findcaller(number=20000):
+    """Measure :meth:`StackLogger.findCaller` with and without diagnostics."""
+    log = StackLogger("bench")
+    saved = stacklogger.usequalname, stacklogger.diagnostics
+    stacklogger.usequalname = False
+    try:
+        for diagnostics in (True, False):
+            stacklogger.diagnostics = diagnostics
+            def run():
+                # Resolve a new name each time, as the first record from a
+                # call site does.
+                stacklogger.qualnames.clear()
+                log.findCaller()
+            timer = timeit.Timer(run)
+            name = "findCaller (diagnostics=%s)" % diagnostics
+            report(name, min(timer.repeat(3, number)), number)
+    finally:
+        stacklogger.usequalname, stacklogger.diagnostics = saved
+
+def bench_callsites(number=20000):
+    """Compare :meth:`StackLogger.findCaller` with and without a call site cache."""
+    saved = stacklogger.usequalname
+    try:
+        for usequalname in (False, True):
+            stacklogger.usequalname = usequalname and saved
+            for callsites in (None, LRUCache(maxsize=20000)):
+                log = StackLogger("bench")
+                log.callsites = callsites
+                timer = timeit.Timer(log.findCaller)
+                name = "findCaller (usequalname=%s, callsites=%s)" % (
+                    stacklogger.usequalname, callsites is not None)
+                report(name, min(timer.repeat(3, number)), number)
+    finally:
+        stacklogger.usequalname = saved
+
+def bench_skiprules(sizes=(0, 10, 1000), number=20000):
+    """Measure the fast :func:`callingframe` walk as the number of rules grows."""
+    frame = inspect.currentframe()
+    for size in sizes:
+        rules = stacklogger.skipped.copy()
+        for i in range(size):
+            rules.addfile("/fake/file%d.py" % i)
+            rules.addmodule("fake.module%d" % i)
+            rules.addpackage("fake%d" % i)
+        timer = timeit.Timer(lambda: callingframe(frame, fast=True, skip=rules))
+        name = "callingframe (%d rules of each kind)" % size
+        report(name, min(timer.repeat(3, number)), number)
+
+def bench_lazy(number=20000):
+    """Compare eager and lazy funcName resolution for records a handler drops."""
+    saved = stacklogger.usequalname
+    stacklogger.usequalname = False
+    try:
+        for lazy in (False, True):
+            log = StackLogger("bench")
+            log.propagate = False
+            log.lazy = lazy
+            handler = logging.NullHandler()
+            handler.setLevel(logging.ERROR)
+            log.addHandler(handler)
+            log.setLevel(logging.DEBUG)
+            def run():
+                stacklogger.qualnames.clear()
+                log.debug("dropped")
+            timer = timeit.Timer(run)
+            name = "dropped StackLogger.debug (lazy=%s)" % lazy
+            report(name, min(timer.repeat(3, number)), number)
+    finally:
+        stacklogger.usequalname = saved
+
+def bench_captureargs(number=20000):
+    """Measure the cost of capturing a large argument that is never formatted."""
+    body = "x" * 1000000
+    for captureargs in (False, True):
+        log = StackLogger("bench")
+        log.propagate = False
+        log.captureargs = captureargs
+        log.addHandler(logging.NullHandler())
+        log.setLevel(logging.DEBUG)
+        def handle(request):
+            log.debug("handling")
+        timer = timeit.Timer(lambda: handle(body))
+        name = "StackLogger.debug (captureargs=%s)" % captureargs
+        report(name, min(timer.repeat(3, number)), number)
+
+def bench_sampler(number=20000):
+    """Compare sampled-out records with records below the logger's level."""
+    for level, probability in ((logging.INFO, None), (logging.DEBUG, 1),
+            (logging.DEBUG, 0)):
+        log = StackLogger("bench")
+        log.propagate = False
+        log.addHandler(logging.NullHandler())
+        log.setLevel(level)
+        if probability is None:
+            name = "StackLogger.debug (below level)"
+        else:
+            log.sampler = RandomSampler(probability)
+            name = "StackLogger.debug (RandomSampler(%s))" % probability
+        timer = timeit.Timer(lambda: log.debug("record"))
+        report(name, min(timer.repeat(3, number)), number)
+
+def bench_callpath(depths=(0, 1, 5, 10, 25), number=5000):
+    """Measure the cost of capturing a call path of increasing depth."""
+    for depth in depths:
+        log = StackLogger("bench")
+        log.propagate = False
+        log.callpath = depth
+        log.addHandler(logging.NullHandler())
+        log.setLevel(logging.DEBUG)
+        def run():
+            for _ in range(number):
+                log.debug("record")
+        timer = timeit.Timer(lambda: deepen(50, run))
+        name = "StackLogger.debug (callpath=%d)" % depth
+        report(name, min(timer.repeat(3, 1)), number)
+
+def bench_filenames(number=20000):
+    """Compare :func:`stacklogger.srcfile` with the :func:`normfile` table."""
+    fname = stacklogger.__file__
+    timer = timeit.Timer(lambda: stacklogger.srcfile(fname))
+    report("srcfile", min(timer.repeat(3, number)), number)
+    timer = timeit.Timer(lambda: stacklogger.normfile(fname))
+    report("normfile", min(timer.repeat(3, number)), number)
+    began = time.time()
+    count = stacklogger.prewarm()
+    report("prewarm (%d files)" % count, time.time() - began, 1)
+
+def bench_sitequeue(number=20000):
+    """Compare queued record size and throughput with and without site numbers."""
+    class Pickling(object):
+        # Stands in for a multiprocessing queue.
+        def put_nowait(self, record):
+            self.data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+    for kind in ("QueueHandler", "SiteQueueHandler"):
+        queue = Pickling()
+        if kind == "QueueHandler":
+            handler = logging.handlers.QueueHandler(queue)
+        else:
+            handler = stacklogger.SiteQueueHandler(queue)
+        log = StackLogger("bench")
+        log.propagate = False
+        log.lazy = kind == "SiteQueueHandler"
+        log.callsites = LRUCache()
+        log.addHandler(handler)
+        log.setLevel(logging.DEBUG)
+        fakes = Fakes(log)
+        timer = timeit.Timer(fakes.method)
+        report("%s producer" % kind, min(timer.repeat(3, number)), number)
+        listener = stacklogger.SiteQueueListener(None)
+        def consume():
+            listener.prepare(pickle.loads(queue.data))
+        timer = timeit.Timer(consume)
+        report("%s consumer" % kind, min(timer.repeat(3, number)), number)
+        print("%-56s %10d bytes" % ("%s payload" % kind, len(queue.data)))
+
+def bench_prescan(number=20000):
+    """Report the cost of :func:`stacklogger.prescan` and of its lookups."""
+    print("%-56s %r" % ("prescan()", stacklogger.prescan()))
+    frame = Fake().method()
+    saved = stacklogger.usequalname
+    stacklogger.usequalname = False
+    try:
+        timer = timeit.Timer(lambda: framefunc(frame))
+        report("framefunc (prescanned)", min(timer.repeat(3, number)), number)
+    finally:
+        stacklogger.usequalname = saved
+        stacklogger.definitions.clear()
+
+def bench_instruments(number=20000):
+    """Measure :meth:`StackLogger.findCaller` with instrumentation enabled."""
+    log = StackLogger("bench")
+    for every in (None, 100, 1):
+        stacklogger.instrument(every)
+        timer = timeit.Timer(log.findCaller)
+        name = "findCaller (instrument(every=%s))" % every
+        report(name, min(timer.repeat(3, number)), number)
+    stacklogger.instrument(None)
+
+def bench_speedups(depths=(0, 10, 50, 200), number=2000):
+    """Compare the C :data:`stacklogger.speedups` with the pure Python versions."""
+    speedups = stacklogger.speedups
+    if speedups is None:
+        print("speedups: not built")
+        return
+    log = StackLogger("bench")
+    log.propagate = False
+    log.addHandler(logging.NullHandler())
+    log.setLevel(logging.DEBUG)
+    frame = Fake().method()
+    try:
+        for using in (None, speedups):
+            stacklogger.speedups = using
+            label = "C" if using else "Python"
+            for depth in depths:
+                def run():
+                    frame = inspect.currentframe()
+                    for _ in range(number):
+                        callingframe(frame, fast=True)
+                timer = timeit.Timer(lambda: deepen(depth, run))
+                name = "callingframe(fast=True) %s depth=%d" % (label, depth)
+                report(name, min(timer.repeat(3, 1)), number)
+            timer = timeit.Timer(lambda: receiver(frame))
+            report("receiver %s" % label, min(timer.repeat(3, number)), number)
+            timer = timeit.Timer(lambda: log.debug("record"))
+            report("StackLogger.debug %s" % label,
+                min(timer.repeat(3, number)), number)
+    finally:
+        stacklogger.speedups = speedups
+
+def wrappers(count):
+    """Return a logging wrapper that goes through *count* skipped frames."""
+    namespace = {}
+    source = "def wrapper0(log):\n    log.debug('record')\n"
+    for level in range(1, count + 1):
+        source += "def wrapper%d(log):\n    wrapper%d(log)\n" % (level, level - 1)
+    exec(compile(source, "benchwrapper.py", "exec"), namespace)
+    return namespace["wrapper%d" % count]
+
+def bench_depths(counts=(0, 5, 20), number=20000):
+    """Compare walking to the caller with jumping to a learned depth."""
+    speedups = stacklogger.speedups
+    try:
+        for using in (None, speedups):
+            if using is None and speedups is None:
+                continue
+            stacklogger.speedups = using
+            for learned in (False, True):
+                for count in counts:
+                    log = StackLogger("bench")
+                    log.propagate = False
+                    log.addHandler(logging.NullHandler())
+                    log.setLevel(logging.DEBUG)
+                    log.callsites = LRUCache()
+                    log.skip = stacklogger.skipped.copy()
+                    log.skip.addfile("benchwrapper.py")
+                    if learned:
+                        log.depths = {}
+                    wrapper = wrappers(count)
+                    timer = timeit.Timer(lambda: wrapper(log))
+                    name = "StackLogger.debug (depths=%s, %s) wrappers=%d" % (
+                        learned, "C" if using else "Python", count)
+                    report(name, min(timer.repeat(3, number)), number)
+    finally:
+        stacklogger.speedups = speedups
+
+def bench_json(number=20000):
+    """Compare :class:`JSONFormatter` with encoding each record's attributes."""
+    log = StackLogger("bench")
+    log.propagate = False
+    log.setLevel(logging.DEBUG)
+    handler = logging.handlers.BufferingHandler(10)
+    log.addHandler(handler)
+    log.debug("record %d from %s", 1, "bench")
+    record = handler.buffer[0]
+    formatter = JSONFormatter()
+    def naive():
+        record.message = record.getMessage()
+        return json.dumps(record.__dict__, default=str)
+    for name, func in (("json.dumps(record.__dict__)", naive),
+            ("JSONFormatter.format", lambda: formatter.format(record))):
+        seconds = min(timeit.Timer(func).repeat(3, number))
+        report(name, seconds, number)
+        print("%-56s %10d records/s" % (name, number / seconds))
+
+def bench_resolve(sites=10, number=10000):
+    """Compare resolving a buffer of lazy records one by one and in bulk."""
+    log = StackLogger("bench")
+    log.propagate = False
+    log.setLevel(logging.DEBUG)
+    log.lazy = True
+    handler = logging.handlers.BufferingHandler(number + 1)
+    log.addHandler(handler)
+    callers = [wrappers(0) for _ in range(sites)]
+    saved = stacklogger.usequalname
+    try:
+        for usequalname in set([False, saved]):
+            stacklogger.usequalname = usequalname
+            for name, flush in (
+                    ("one by one", lambda records: [(record.pathname,
+                        record.lineno, str(record.funcName))
+                        for record in records]),
+                    ("resolve(records)", stacklogger.resolve)):
+                best = None
+                for _ in range(3):
+                    del(handler.buffer[:])
+                    stacklogger.qualnames.clear()
+                    for index in range(number):
+                        callers[index % sites](log)
+                    start = time.perf_counter()
+                    flush(handler.buffer)
+                    seconds = time.perf_counter() - start
+                    best = seconds if best is None else min(best, seconds)
+                report("%s (usequalname=%s) sites=%d" % (name, usequalname,
+                    sites), best, number)
+    finally:
+        stacklogger.usequalname = saved
+
+STARTUP = """
+import sys, time
+began = time.perf_counter()
+import logging
+imported = time.perf_counter()
+import stacklogger
+loaded = time.perf_counter()
+logging.setLoggerClass(stacklogger.StackLogger)
+log = logging.getLogger("bench.startup")
+log.propagate = False
+log.addHandler(logging.NullHandler())
+log.setLevel(logging.DEBUG)
+ready = time.perf_counter()
+log.debug("first record")
+done = time.perf_counter()
+log.debug("second record")
+print(imported - began, loaded - imported, done - ready,
+    time.perf_counter() - done)
+"""
+
+def bench_startup(number=10):
+    """Measure importing :mod:`stacklogger` and logging its first records.
+
+    Each measurement runs a new interpreter, after a first run that writes
+    bytecode caches. 'python -X importtime' reports the import's cumulative
+    cost, too.
+    """
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    command = [sys.executable, "-c", STARTUP]
+    subprocess.check_output(command, env=env)
+    results = []
+    for _ in range(number):
+        output = subprocess.check_output(command, env=env)
+        results.append([float(value) for value in output.split()])
+    names = ("import logging", "import stacklogger", "first record",
+        "second record")
+    for index, name in enumerate(names):
+        report("startup: %s" % name, min(r[index] for r in results), 1)
+
+    output = subprocess.check_output(
+        [sys.executable, "-X", "importtime", "-c", "import stacklogger"],
+        env=env, stderr=subprocess.STDOUT).decode()
+    for line in output.splitlines():
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == "stacklogger":
+            report("startup: -X importtime stacklogger (cumulative)",
+                int(fields[1]) * 1e-6, 1)
+    modules = subprocess.check_output([sys.executable, "-c",
+        "import sys, stacklogger; print(' '.join(sorted(sys.modules)))"],
+        env=env).decode().split()
+    print("%-56s %10d" % ("startup: modules loaded", len(modules)))
+
+def threaded(nthreads, func, number):
+    """Run *func* *number* times in each of *nthreads* threads.
+
+    Returns the total number of calls per second.
+    """
+    start = threading.Event()
+    def run():
+        start.wait()
+        for _ in range(number):
+            func()
+    threads = [threading.Thread(target=run) for _ in range(nthreads)]
+    for thread in threads:
+        thread.start()
+    began = time.time()
+    start.set()
+    for thread in threads:
+        thread.join()
+    return nthreads * number / (time.time() - began)
+
+def bench_threads(counts=(1, 2, 4, 8, 16, 64), number=5000):
+    """Measure records/sec from 1 to N threads with shared and per-thread caches.
+
+    With a global interpreter lock, total throughput can't grow with the
+    number of threads; it should stay flat rather than fall off as threads
+    are added.
+    """
+    saved = stacklogger.usequalname, stacklogger.qualnames
+    stacklogger.usequalname = False
+    try:
+        for kind in ("LRUCache", "FrontCache"):
+            for nthreads in counts:
+                if kind == "LRUCache":
+                    stacklogger.qualnames = LRUCache()
+                    callsites = LRUCache(maxsize=20000)
+                else:
+                    stacklogger.qualnames = FrontCache()
+                    callsites = FrontCache(LRUCache(maxsize=20000))
+                log = StackLogger("bench")
+                log.propagate = False
+                log.callsites = callsites
+                log.addHandler(logging.NullHandler())
+                log.setLevel(logging.DEBUG)
+                rate = threaded(nthreads, lambda: log.debug("record"), number)
+                print("%-56s %10d records/s" % (
+                    "%s threads=%d" % (kind, nthreads), rate))
+    finally:
+        stacklogger.usequalname, stacklogger.qualnames = saved
+
+def bench_tasks(counts=(1, 100, 10000), records=10):
+    """Measure per-record cost with many concurrent :mod:`asyncio` tasks."""
+    import asyncio
+    log = StackLogger("bench")
+    log.propagate = False
+    log.coroutines = True
+    log.addHandler(logging.NullHandler())
+    log.setLevel(logging.DEBUG)
+    async def work():
+        for _ in range(records):
+            log.debug("record")
+            await asyncio.sleep(0)
+    async def main(ntasks):
+        began = time.time()
+        await asyncio.gather(*[work() for _ in range(ntasks)])
+        return time.time() - began
+    for ntasks in counts:
+        elapsed = asyncio.run(main(ntasks))
+        report("coroutines tasks=%d" % ntasks, elapsed, ntasks * records)
+
+class NullStream(object):
+    """A stream that discards everything written to it."""
+
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+class Fakes(object):
+    """Call sites of each kind, modeled on the fixtures in tests.py."""
+
+    def __init__(self, log):
+        self.log = log
+
+    def method(self):
+        self.log.debug("in method")
+
+    @property
+    def property(self):
+        self.log.debug("in property")
+
+    @classmethod
+    def classmethod(cls, log):
+        log.debug("in classmethod")
+
+    @staticmethod
+    def staticmethod(log):
+        log.debug("in staticmethod")
+
+def function(log):
+    log.debug("in function")
+
+lambda_ = lambda log: log.debug("in lambda")
+
+def callsite(shape, log):
+    """Return a callable that logs one record from a call site of kind *shape*."""
+    fakes = Fakes(log)
+    return dict(
+        function=lambda: function(log),
+        method=fakes.method,
+        property=lambda: fakes.property,
+        classmethod=lambda: Fakes.classmethod(log),
+        staticmethod=lambda: Fakes.staticmethod(log),
+        _lambda=lambda: lambda_(log),
+    )[shape]
+
+SHAPES = ("function", "method", "property", "classmethod", "staticmethod",
+    "_lambda")
+
+def makelogger(cls, handler):
+    """Return a new logger of class *cls* with a handler that is *handler*."""
+    log = cls("bench.suite")
+    log.propagate = False
+    log.setLevel(logging.DEBUG)
+    stream = logging.StreamHandler(NullStream())
+    stream.setFormatter(logging.Formatter(
+        "%(funcName)s %(filename)s:%(lineno)d %(message)s"))
+    if handler == "disabled":
+        stream.setLevel(logging.CRITICAL)
+    log.addHandler(stream)
+    return log
+
+def measure(func, depth, nthreads, number):
+    """Return the wall time per call of *func* beneath *depth* frames."""
+    def run():
+        for _ in range(number):
+            func()
+    if nthreads == 1:
+        began = time.time()
+        deepen(depth, run)
+        return (time.time() - began) / number
+    start = threading.Event()
+    def worker():
+        start.wait()
+        deepen(depth, run)
+    threads = [threading.Thread(target=worker) for _ in range(nthreads)]
+    for thread in threads:
+        thread.start()
+    began = time.time()
+    start.set()
+    for thread in threads:
+        thread.join()
+    return (time.time() - began) / (number * nthreads)
+
+def allocations(func, depth, number):
+    """Return the mean and peak bytes allocated per call of *func*."""
+    def run():
+        for _ in range(number):
+            func()
+    tracemalloc.start()
+    try:
+        func()
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        deepen(depth, func)
+        peak = tracemalloc.get_traced_memory()[1] - before
+        before = tracemalloc.take_snapshot()
+        deepen(depth, run)
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    retained = sum([stat.size_diff for stat in after.compare_to(before, "filename")])
+    return retained / float(number), peak
+
+def suite(depths=(10, 50, 200), threads=(1, 4), number=2000, shapes=SHAPES):
+    """Run the benchmark suite and return a list of result dictionaries."""
+    results = []
+    for cls in (logging.Logger, StackLogger):
+        for handler in ("disabled", "enabled"):
+            for shape in shapes:
+                for depth in depths:
+                    for nthreads in threads:
+                        log = makelogger(cls, handler)
+                        func = callsite(shape, log)
+                        func()
+                        seconds = measure(func, depth, nthreads, number)
+                        retained, peak = allocations(func, depth, number // 10)
+                        result = dict(
+                            logger=cls.__name__,
+                            handler=handler,
+                            shape=shape,
+                            depth=depth,
+                            threads=nthreads,
+                            ns=seconds * 1e9,
+                            retained_bytes=retained,
+                            peak_bytes=peak,
+                        )
+                        results.append(result)
+                        print("%(logger)-12s %(handler)-9s %(shape)-13s "
+                            "depth=%(depth)-4d threads=%(threads)-2d "
+                            "%(ns)10.0f ns/record %(peak_bytes)8d peak bytes"
+                            % result)
+    return results
+
+def metadata():
+    """Describe the environment the suite ran in."""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"],
+            stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(
+        python=platform.python_version(),
+        implementation=platform.python_implementation(),
+        platform=platform.platform(),
+        commit=commit,
+        time=time.time(),
+    )
+
+def key(result):
+    return tuple([result[name]
+        for name in ("logger", "handler", "shape", "depth", "threads")])
+
+def compare(before, after):
+    """Print the change in ns/record for each case in two saved suite runs."""
+    old = dict([(key(result), result) for result in before["results"]])
+    for result in after["results"]:
+        previous = old.get(key(result))
+        if previous is None:
+            continue
+        change = (result["ns"] - previous["ns"]) / previous["ns"] * 100
+        print("%-12s %-9s %-13s depth=%-4d threads=%-2d "
+            "%10.0f -> %10.0f ns/record (%+.1f%%)" % (key(result) +
+            (previous["ns"], result["ns"], change)))
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark stacklogger.")
+    commands = parser.add_subparsers(dest="command")
+    run = commands.add_parser("suite", help="run the benchmark suite")
+    run.add_argument("-o", "--output", help="save results to this JSON file")
+    run.add_argument("-n", "--number", type=int, default=2000,
+        help="records per case (default: %(default)s)")
+    run.add_argument("--quick", action="store_true",
+        help="only run depth 10 with a single thread")
+    diff = commands.add_parser("compare", help="compare two saved results")
+    diff.add_argument("before")
+    diff.add_argument("after")
+    args = parser.parse_args(argv)
+
+    if args.command == "suite":
+        options = dict(number=args.number)
+        if args.quick:
+            options.update(depths=(10,), threads=(1,))
+        output = dict(metadata=metadata(), results=suite(**options))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(output, f, indent=1, sort_keys=True)
+    elif args.command == "compare":
+        with open(args.before) as f:
+            before = json.load(f)
+        with open(args.after) as f:
+            after = json.load(f)
+        compare(before, after)
+    else:
+        micro()
+
+def micro():
+    """Run the microbenchmarks."""
+    bench_callingframe()
+    bench_framefunc()
+    bench_resolvers()
+    bench_findcaller()
+    bench_callsites()
+    bench_skiprules()
+    bench_lazy()
+    bench_captureargs()
+    bench_sampler()
+    bench_callpath()
+    bench_filenames()
+    bench_sitequeue()
+    bench_prescan()
+    bench_instruments()
+    bench_speedups()
+    bench_depths()
+    bench_json()
+    bench_resolve()
+    bench_startup()
+    bench_threads()
+    bench_tasks()
+    bench_record()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
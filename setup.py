@@ -1,6 +1,6 @@
 import sys
 
-from setuptools import setup
+from setuptools import Extension, setup
 
 meta = dict(
     name="stacklogger",
@@ -9,6 +9,9 @@ meta = dict(
     author="Will Maier",
     author_email="willmaier@ml1.net",
     py_modules=["stacklogger"],
+    # The C speedups are optional; stacklogger works without them if they
+    # can't be built.
+    ext_modules=[Extension("_stacklogger", ["_stacklogger.c"], optional=True)],
     test_suite="tests",
     install_requires=["setuptools"],
     keywords="logging stack frame",
@@ -1,16 +1,33 @@
-import inspect
 import logging
 import os
 import sys
+import threading
+import time
 import types
+import weakref
 
-__all__ = ["srcfile", "callingframe", "framefunc", "StackLogger"]
-__todo__ = [item for item in """
- * make method/function args/values available in log format
-""".split(" * ") if item]
+from collections import OrderedDict
+from itertools import count
+
+try:
+    import reprlib
+except ImportError:
+    import repr as reprlib
+
+__all__ = ["srcfile", "normfile", "prewarm", "callingframe", "jumpframe", "callerinfo",
+    "framefunc", "codefunc", "resolve", "prescan", "CallerInfo", "FuncName", "FuncArgs", "CallPath", "LRUCache", "FrontCache",
+    "SkipRules", "Sampler", "RandomSampler", "TokenBucketSampler",
+    "SiteQueueHandler", "SiteQueueListener", "JSONFormatter", "Instruments", "instrument",
+    "StackLogger"]
+__todo__ = []
 
 NoMatch = object()
 
+if not hasattr(OrderedDict, "move_to_end"):
+    class OrderedDict(OrderedDict):
+        def move_to_end(self, key):
+            self[key] = self.pop(key)
+
 try:
     from logging import NullHandler
 except ImportError:
@@ -18,8 +35,29 @@ except ImportError:
         def emit(self, record):
             pass
 
-# A logger for a logger...
-logging.getLogger("stacklogger").addHandler(NullHandler())
+# Optional C versions of some of the functions below (see _stacklogger.c),
+# used when the extension was built. Setting STACKLOGGER_PURE in the
+# environment forces the pure Python versions.
+speedups = None
+if not os.environ.get("STACKLOGGER_PURE"):
+    try:
+        import _stacklogger as speedups
+    except ImportError:
+        pass
+
+# A logger for a logger... It gets a NullHandler with its first message
+# (see diagnose()).
+log = logging.getLogger("stacklogger")
+
+# StackLogger's own debugging messages are only sent to the logger above if
+# this is True.
+diagnostics = False
+
+def diagnose(msg, *args):
+    """Send a debugging message to :data:`log`."""
+    if not log.handlers:
+        log.addHandler(NullHandler())
+    log.debug(msg, *args)
 
 def srcfile(fname):
     """Sanitize a Python module's filename.
@@ -31,55 +69,1533 @@ def srcfile(fname):
         fname = fname.lower()[:-4] + ".py"
     return os.path.normcase(os.path.abspath(fname))
 
-def callingframe(frame):
-    """Return info about the first non-logging related frame from *frame*'s stack."""
-    # Frames in these files are logging-related and should be skipped.
-    logfiles = (logging._srcfile, srcfile(__file__))
-    for frame in inspect.getouterframes(frame):
-        filename = frame[1]
-        if filename not in logfiles:
-            return frame
+try:
+    intern = sys.intern
+except AttributeError:
+    pass
 
-def framefunc(frame):
-    """Return a string representation of the code object at *frame*.
+# Normalized, interned filenames, keyed by the filenames code objects carry.
+filenames = {}
 
-    *frame* should be a Python interpreter stack frame with a current
-    code object (or a sequence with such a frame as its first element).
-    :meth:`framefunc` will try to determine where the calling function was
-    defined; if the function was defined in a class (as with properties,
-    methods and classmethods), the class' name will be prepended to the function
-    name (like *class.function*).
+def normfile(fname):
+    """Return the normalized form of code filename *fname*.
+
+    The result is the same as :func:`srcfile`, but each filename is only
+    normalized once. The results are interned and remembered in
+    :data:`filenames`, so every record from the same file shares a single
+    string. Pseudo-filenames like '<string>' are returned unchanged.
     """
-    log = logging.getLogger("stacklogger")
-    if not isinstance(frame, types.FrameType):
-        frame = frame[0]
-    name = frame.f_code.co_name
+    try:
+        return filenames[fname]
+    except KeyError:
+        pass
+    if fname.startswith("<"):
+        name = fname
+    else:
+        name = intern(srcfile(fname))
+    filenames[fname] = name
+    return name
+
+def prewarm(modules=None):
+    """Fill :data:`filenames` with the files of *modules*.
+
+    *modules* defaults to every module in :data:`sys.modules`. Returns the
+    number of filenames added.
+    """
+    if modules is None:
+        modules = list(sys.modules.values())
+    count = len(filenames)
+    for module in modules:
+        fname = getattr(module, "__file__", None)
+        if not fname:
+            continue
+        normfile(fname)
+        # Modules loaded from bytecode run code that names the source file.
+        if fname.lower()[-4:] in (".pyc", ".pyo"):
+            normfile(fname[:-1])
+    return len(filenames) - count
+
+class SkipRules(object):
+    """Rules that decide which frames :func:`callingframe` should skip.
+
+    A frame is skipped if its code was loaded from a file added with
+    :meth:`addfile`, or if its module (the frame's *__name__* global) was
+    added with :meth:`addmodule` or belongs to a package added with
+    :meth:`addpackage`. Each file's decision is made once and remembered in
+    :attr:`decisions`, so checking a frame costs a single dictionary lookup
+    no matter how many rules are registered.
+    """
+
+    def __init__(self, files=(), modules=(), packages=()):
+        self.files = set()
+        self.modules = set(modules)
+        self.packages = set(packages)
+        self.decisions = {}
+        for fname in files:
+            self.addfile(fname)
+
+    def copy(self):
+        """Return a new :class:`SkipRules` with the same rules."""
+        rules = self.__class__(modules=self.modules, packages=self.packages)
+        rules.files.update(self.files)
+        return rules
+
+    def addfile(self, fname):
+        """Skip frames running code from the file *fname*."""
+        self.files.update([fname, srcfile(fname)])
+        self.decisions.clear()
+
+    def addmodule(self, name):
+        """Skip frames running code from the module called *name*."""
+        self.modules.add(name)
+        self.decisions.clear()
+
+    def addpackage(self, name):
+        """Skip frames running code from the package *name* or its submodules."""
+        self.packages.add(name)
+        self.decisions.clear()
+
+    def skips(self, frame):
+        """Return True if *frame* is logging-related."""
+        fname = frame.f_code.co_filename
+        try:
+            return self.decisions[fname]
+        except KeyError:
+            pass
+        skip = self.decide(fname, frame.f_globals.get("__name__"))
+        # Code compiled from strings shares pseudo-filenames like
+        # '<string>' across modules, so only remember real files.
+        if not fname.startswith("<"):
+            self.decisions[fname] = skip
+        return skip
+
+    def decide(self, fname, module):
+        """Return True if code from file *fname* in *module* should be skipped."""
+        files = self.files
+        if fname in files or normfile(fname) in files:
+            return True
+        if not module:
+            return False
+        if module in self.modules:
+            return True
+        packages = self.packages
+        prefix = None
+        for part in module.split("."):
+            prefix = part if prefix is None else prefix + "." + part
+            if prefix in packages:
+                return True
+        return False
+
+def logfilenames():
+    """Return the filenames of the :mod:`logging` package and this module."""
+    names = [
+        logging.addLevelName.__code__.co_filename,
+        logfilenames.__code__.co_filename,
+        __file__,
+    ]
+    if logging._srcfile:
+        names.append(logging._srcfile)
+    return names
+
+# The rules used by callingframe() and StackLogger unless they're given their
+# own.
+skipped = SkipRules(files=logfilenames())
+
+def refresh():
+    """Add the current :mod:`logging` filenames to :data:`skipped`.
+
+    Call :func:`refresh` if :data:`logging._srcfile` changes.
+    """
+    for fname in logfilenames():
+        skipped.addfile(fname)
+
+def callingframe(frame, fast=False, skip=None, stacklevel=1):
+    """Return info about the first non-logging related frame from *frame*'s stack.
+
+    :func:`callingframe` follows *frame*'s *f_back* links one at a time and
+    stops at the first frame that isn't logging-related, so its cost depends
+    only on the number of logging frames it skips; it never holds a list of
+    frames. By default, the result is a frame record like those returned by
+    :func:`inspect.getouterframes`, including source context lines. If *fast*
+    is True, the frame object itself is returned instead. The walk uses the C
+    version in :data:`speedups`, if it is available.
+
+    Frames are skipped according to *skip*, a :class:`SkipRules` instance
+    (or :data:`skipped`, if *skip* is None). If *stacklevel* is greater than
+    one, :func:`callingframe` returns the *stacklevel*-th frame that isn't
+    skipped instead of the first, like the *stacklevel* argument to
+    :meth:`logging.Logger.debug`; if the stack isn't that deep, the outermost
+    frame that isn't skipped is used. Returns None if every frame is
+    skipped.
+    """
+    if skip is None:
+        skip = skipped
+    if not fast:
+        frame = callingframe(frame, True, skip, stacklevel)
+        if frame is None:
+            return None
+        import inspect
+        record = (frame,) + tuple(inspect.getframeinfo(frame))
+        FrameInfo = getattr(inspect, "FrameInfo", None)
+        if FrameInfo is not None:
+            record = FrameInfo(*record)
+        return record
+
+    if speedups is not None:
+        return speedups.walk(frame, skip.decisions, skip, stacklevel)
+    decisions = skip.decisions
+    last = None
+    while frame is not None:
+        skips = decisions.get(frame.f_code.co_filename)
+        if skips is None:
+            skips = skip.skips(frame)
+        if not skips:
+            if stacklevel <= 1:
+                return frame
+            stacklevel -= 1
+            last = frame
+        frame = frame.f_back
+    return last
+
+def jumpframe(depths, depth, skip=None):
+    """Return the first frame that isn't skipped, jumping straight to it if possible.
+
+    The search starts at the caller of :func:`jumpframe`. The logging entry
+    point called by user code (like :meth:`logging.Logger.debug`) is
+    expected *depth* frames above that caller.
+
+    *depths* maps the skip rules and entry point code to the distances from
+    the entry point to the first frames that weren't skipped, along with the
+    code of the frame just below each, so loggers with different rules can
+    share it. A learned distance is used if the frame just below it
+    still runs that code and the frame there is known to not be skipped;
+    otherwise, the stack is walked with :func:`callingframe` and the new
+    distance is learned. This assumes that a given wrapper always reaches the
+    entry point through the same frames. See :attr:`StackLogger.depths`.
+    """
+    if skip is None:
+        skip = skipped
+    getframe = sys._getframe
+    try:
+        entry = getframe(depth + 1).f_code
+    except ValueError:
+        entry = None
+    key = (skip, entry)
+    learned = depths.get(key, ())
+    decisions = skip.decisions
+    for offset, code in learned:
+        try:
+            frame = getframe(depth + offset)
+        except ValueError:
+            continue
+        if frame.f_code is code:
+            frame = frame.f_back
+            if frame is None:
+                continue
+            skips = decisions.get(frame.f_code.co_filename)
+            if skips is None:
+                skips = skip.skips(frame)
+            if not skips:
+                return frame
+
+    frame = start = getframe(1)
+    frame = callingframe(frame, fast=True, skip=skip)
+    if frame is None or entry is None:
+        return frame
+    distance, last = 0, None
+    while start is not frame:
+        last, start = start, start.f_back
+        distance += 1
+    offset = distance - depth
+    if offset > 0:
+        depths[key] = ((offset, last.f_code),) + learned[:3]
+    del(start, last)
+    return frame
+
+class LRUCache(object):
+    """A bounded mapping that discards its least recently used items.
+
+    :class:`LRUCache` holds at most *maxsize* items (or any number of items if
+    *maxsize* is None). It counts lookups that found an item (*hits*), lookups
+    that didn't (*misses*) and items discarded to make room for new ones
+    (*evictions*).
+
+    Lookups don't take a lock, so threads that mostly hit the cache don't
+    wait on each other; only :meth:`set` and :meth:`clear` do. The counters
+    are updated without locking and may undercount a little when many
+    threads use the cache at once. See :class:`FrontCache` for a cache that
+    shares no state between threads on hits.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        """Return the value for *key* (or *default*) and mark it as recently used."""
+        data = self.data
+        try:
+            value = data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        try:
+            data.move_to_end(key)
+        except KeyError:
+            # Another thread evicted the item after we found it.
+            pass
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """Store *value* under *key*, evicting old items if the cache is full."""
+        data = self.data
+        with self.lock:
+            data.pop(key, None)
+            data[key] = value
+            if self.maxsize is None:
+                return
+            while len(data) > self.maxsize:
+                data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Discard all items and reset the counters."""
+        with self.lock:
+            self.data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Return a dictionary describing the cache's size and counters."""
+        lookups = self.hits + self.misses
+        return dict(
+            size=len(self.data),
+            maxsize=self.maxsize,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            hitrate=lookups and float(self.hits) / lookups or 0.0,
+        )
+
+class ThreadFront(object):
+    """One thread's items and counters for a :class:`FrontCache`."""
+    __slots__ = ("data", "generation", "hits", "__weakref__")
+
+    def __init__(self, generation):
+        self.data = {}
+        self.generation = generation
+        self.hits = 0
+
+class FrontCache(object):
+    """A per-thread front for a shared cache.
+
+    Each thread keeps a small dictionary of the items it has used. Lookups
+    that find an item there take no locks and write nothing shared with other
+    threads. Other lookups fall through to *shared* (a new :class:`LRUCache`
+    if *shared* is None), and the result is copied into the thread's
+    dictionary, which is emptied when it holds more than *maxsize* items.
+    :meth:`clear` empties *shared* and tells every thread to empty its own
+    dictionary before its next lookup.
+
+    :class:`FrontCache` has the same interface as :class:`LRUCache`, so it can
+    be used for :data:`qualnames` or :attr:`StackLogger.callsites`.
+    """
+
+    def __init__(self, shared=None, maxsize=256):
+        if shared is None:
+            shared = LRUCache()
+        self.shared = shared
+        self.maxsize = maxsize
+        self.generation = 0
+        self.local = threading.local()
+        # Fronts disappear from here when their threads exit. New threads add
+        # theirs while holding the lock, so that others can safely list them.
+        self.fronts = weakref.WeakSet()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.shared)
+
+    def __contains__(self, key):
+        return key in self.shared
+
+    def front(self):
+        """Return the calling thread's :class:`ThreadFront`."""
+        try:
+            front = self.local.front
+        except AttributeError:
+            front = self.local.front = ThreadFront(self.generation)
+            with self.lock:
+                self.fronts.add(front)
+        if front.generation != self.generation:
+            front.data.clear()
+            front.generation = self.generation
+        return front
+
+    def get(self, key, default=None):
+        """Return the value for *key* (or *default*)."""
+        front = self.front()
+        data = front.data
+        try:
+            value = data[key]
+        except KeyError:
+            pass
+        else:
+            front.hits += 1
+            return value
+        value = self.shared.get(key, NoMatch)
+        if value is NoMatch:
+            return default
+        if len(data) >= self.maxsize:
+            data.clear()
+        data[key] = value
+        return value
+
+    def set(self, key, value):
+        """Store *value* under *key* in the shared cache."""
+        self.shared.set(key, value)
+        data = self.front().data
+        if len(data) >= self.maxsize:
+            data.clear()
+        data[key] = value
+
+    def clear(self):
+        """Discard all items in the shared cache and every thread's front."""
+        self.shared.clear()
+        self.generation += 1
+        for front in self.threadfronts():
+            front.hits = 0
+
+    def threadfronts(self):
+        """Return a list of the :class:`ThreadFront` of each live thread."""
+        with self.lock:
+            return list(self.fronts)
+
+    def stats(self):
+        """Return :meth:`LRUCache.stats` for the shared cache, including front hits."""
+        stats = self.shared.stats()
+        fronts = self.threadfronts()
+        fronthits = sum([front.hits for front in fronts])
+        lookups = fronthits + stats["hits"] + stats["misses"]
+        stats.update(
+            fronthits=fronthits,
+            threads=len(fronts),
+            hits=fronthits + stats["hits"],
+            hitrate=lookups and float(fronthits + stats["hits"]) / lookups or 0.0,
+        )
+        return stats
+
+# Qualified function names, keyed by (code object, receiver class).
+qualnames = LRUCache()
+
+# Names of functions defined in classes, keyed by code object. See prescan().
+definitions = {}
+
+# Python 3.11 and newer record a function's qualified name on its code
+# object, so there's no need to guess the class it was defined in. Set this to
+# False to use the instance-sniffing heuristic anyway.
+usequalname = hasattr(srcfile.__code__, "co_qualname")
+
+def receiver(frame):
+    """Return the class that *frame*'s code was probably called on.
+
+    If the code at *frame* takes positional arguments, the first one is
+    assumed to be the instance (or class) the code was called on. Returns None
+    if the code takes no positional arguments. No other local variables are
+    read, but without the C :data:`speedups` on Python 3.12 or newer, reading
+    the argument builds *frame.f_locals*.
+    """
+    if speedups is not None:
+        return speedups.receiver(frame)
+    code = frame.f_code
+    if not code.co_argcount:
+        return None
+    try:
+        instance = frame.f_locals[code.co_varnames[0]]
+    except KeyError:
+        return None
+    if isinstance(instance, type):
+        return instance
+    return instance.__class__
+
+def codefunc(code, cls=None):
+    """Return a string representation of *code*, called on an instance of *cls*.
+
+    *cls* should be the value returned by :func:`receiver` for a frame
+    running *code*. Names found ahead of time by :func:`prescan` are used
+    first. If :data:`usequalname` is set, *code*'s own qualified name is used
+    and *cls* is ignored. Otherwise, results are cached in :data:`qualnames`,
+    so each combination of *code* and *cls* is only examined once.
+    """
+    if definitions:
+        name = definitions.get(code)
+        if name is not None:
+            return name
+    if usequalname:
+        return qualnamefunc(code)
+    key = (code, cls)
+    name = qualnames.get(key)
+    if name is None:
+        name = classfunc(code, cls)
+        qualnames.set(key, name)
+    return name
+
+def qualnamefunc(code):
+    """Return *code*'s qualified name, without any enclosing function scopes.
+
+    This requires the *co_qualname* attribute added to code objects in
+    Python 3.11.
+    """
+    name = code.co_qualname
+    if name == "<module>":
+        return "__main__"
+    return shortqualname(name)
+
+def shortqualname(name):
+    """Remove any enclosing function scopes from the qualified name *name*."""
+    if "<locals>." in name:
+        name = name.rpartition("<locals>.")[2]
+    return name
+
+def classfunc(code, cls):
+    """Guess the name of *code*, called on *cls*, bypassing :data:`qualnames`."""
+    name = code.co_name
     if name == "<module>":
         name = "__main__"
-    log.debug("Building context for %s", name)
+    if diagnostics:
+        diagnose("Building context for %s", name)
+    if cls is None:
+        return name
     context = [name]
 
-    accesserr = (AttributeError, IndexError, KeyError)
-    # If the first argument to the frame's code is an instance, and that
-    # instance has a attribute with the same name as the frame's code, assume that
-    # the code is a attribute of that instance. Use instance.__class__.__dict__
-    # here because instance.name (or getattr(instance, name) can cause things
-    # like properties to load in an infinite recursion.
-    instance = None
+    # If the first argument to the code is an instance (or class), and its
+    # class has an attribute with the same name as the code, assume that the
+    # code is an attribute of that class. Use cls.__dict__ here because
+    # instance.name (or getattr(instance, name) can cause things like
+    # properties to load in an infinite recursion.
     try:
-        instance = frame.f_locals[frame.f_code.co_varnames[0]]
-        cls = instance.__class__
         obj = cls.__dict__[name]
-        log.debug("Found %s attribute on instance %s", name, instance)
-    except accesserr:
-        obj = getattr(instance, name, NoMatch)
-        if obj is not NoMatch:
-            cls = instance
+        if diagnostics:
+            diagnose("Found %s attribute on class %s", name, cls)
+    except (AttributeError, KeyError):
+        if instruments is not None:
+            instruments.fallbacks += 1
+        obj = getattr(cls, name, NoMatch)
 
     if obj is not NoMatch:
         context.insert(0, cls.__name__)
     return '.'.join(context)
 
+def classcodes(cls, failed=None):
+    """Yield (name, code) pairs for the functions defined in class *cls*.
+
+    Methods, class methods, static methods and property accessors are
+    included. Decorated functions are followed through *__wrapped__* to the
+    function that was defined in the class. Only code whose name and
+    qualified name say it was defined there is yielded, so wrappers shared
+    by many functions and functions merely assigned to the class are left
+    out. Attributes that raise when examined, like some proxies, are left
+    out too, and their names are appended to the list *failed*.
+    """
+    prefix = getattr(cls, "__qualname__", cls.__name__) + "."
+    for name, obj in list(vars(cls).items()):
+        try:
+            code = definedcode(obj, name, prefix)
+        except Exception:
+            if failed is not None:
+                failed.append(name)
+            continue
+        if code is not None:
+            yield name, code
+
+def definedcode(obj, name, prefix):
+    """Return the code of *obj* if it's a function defined as *prefix* + *name*."""
+    if isinstance(obj, (staticmethod, classmethod)):
+        funcs = [obj.__func__]
+    elif isinstance(obj, property):
+        funcs = [obj.fget, obj.fset, obj.fdel]
+    else:
+        funcs = [obj]
+    for func in funcs:
+        # Guard against __wrapped__ cycles.
+        depth = 0
+        while func is not None and depth < 10:
+            code = getattr(func, "__code__", None)
+            if isinstance(code, types.CodeType) and code.co_name == name:
+                # functools.wraps() copies the wrapped function's
+                # __qualname__ to the wrapper, but not its code's.
+                qualname = getattr(code, "co_qualname",
+                    getattr(func, "__qualname__", None))
+                if qualname is None or qualname == prefix + name:
+                    return code
+            func = getattr(func, "__wrapped__", None)
+            depth += 1
+    return None
+
+def definedclasses(namespace, modname, failed):
+    """Return the classes in dictionary *namespace* defined in module *modname*.
+
+    The names of values that raise when examined are appended to *failed*.
+    """
+    classes = []
+    for name, obj in list(namespace.items()):
+        try:
+            if isinstance(obj, type) and obj.__module__ == modname:
+                classes.append(obj)
+        except Exception:
+            failed.append(name)
+    return classes
+
+def inpackages(name, prefixes):
+    """Return True if module *name* is a package in *prefixes* or in one.
+
+    Each of *prefixes* is a package name followed by a dot.
+    """
+    return name is not None and (name + ".").startswith(prefixes)
+
+def prescan(modules=None, packages=None):
+    """Find the names of functions defined in classes ahead of time.
+
+    The classes defined in *modules* (or, by default, every module in
+    :data:`sys.modules`) are examined, and the code of each of their
+    functions is mapped to a *class.function* name in :data:`definitions`.
+    If *packages* is given, only modules in those packages are examined.
+    :func:`codefunc` then finds these names with a single lookup, without
+    guessing (so static methods get their class, too).
+
+    Returns a dictionary describing the scan: the number of *modules*,
+    *classes* and *functions* examined, the number of classes and attributes
+    *skipped* because they raised when examined, and the *seconds* it took.
+    """
+    began = time.time()
+    if modules is None:
+        modules = list(sys.modules.values())
+    if packages is not None:
+        prefixes = tuple(package + "." for package in packages)
+        modules = [module for module in modules
+            if inpackages(getattr(module, "__name__", None), prefixes)]
+    report = dict(modules=0, classes=0, functions=0, skipped=0)
+    seen = set()
+    for module in modules:
+        if module is None:
+            continue
+        modname = getattr(module, "__name__", None)
+        report["modules"] += 1
+        failed = []
+        classes = definedclasses(vars(module), modname, failed)
+        while classes:
+            cls = classes.pop()
+            if cls in seen:
+                continue
+            seen.add(cls)
+            report["classes"] += 1
+            try:
+                classes.extend(definedclasses(vars(cls), modname, failed))
+                codes = list(classcodes(cls, failed))
+                qualname = shortqualname(getattr(cls, "__qualname__",
+                    cls.__name__))
+            except Exception:
+                failed.append(cls)
+                continue
+            for name, code in codes:
+                definitions.setdefault(code, "%s.%s" % (qualname, name))
+                report["functions"] += 1
+        report["skipped"] += len(failed)
+    report["seconds"] = time.time() - began
+    return report
+
+class FuncName(object):
+    """The name of a function, resolved only when it is used as a string.
+
+    :class:`FuncName` stores *code* and *cls* (see :func:`codefunc`) rather
+    than a frame, so it doesn't keep the stack alive. The name is resolved the
+    first time the :class:`FuncName` is converted to a string (for example,
+    by a :class:`logging.Formatter`) and remembered afterwards. It compares
+    and hashes like that string, and pickles as one.
+    """
+    __slots__ = ("code", "cls", "name")
+
+    def __init__(self, code, cls=None):
+        self.code = code
+        self.cls = cls
+        self.name = None
+
+    def __str__(self):
+        name = self.name
+        if name is None:
+            name = self.name = codefunc(self.code, self.cls)
+        return name
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __format__(self, spec):
+        return format(str(self), spec)
+
+    def __eq__(self, other):
+        return str(self) == other
+
+    def __ne__(self, other):
+        return str(self) != other
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __reduce__(self):
+        return (str, (str(self),))
+
+class CallerInfo(object):
+    """What :class:`StackLogger` needs to know about a calling frame.
+
+    A :class:`CallerInfo` holds the frame's code object, filename (as
+    normalized by :func:`normfile`), line number, last instruction offset
+    (*lasti*) and receiver class (*cls*, see :func:`receiver`). It doesn't
+    keep the frame itself (frames can't be weakly referenced) or any source
+    lines.
+    """
+    __slots__ = ("code", "filename", "lineno", "lasti", "cls")
+
+    def __init__(self, code, lineno, lasti=-1, cls=None):
+        self.code = code
+        self.filename = normfile(code.co_filename)
+        self.lineno = lineno
+        self.lasti = lasti
+        self.cls = cls
+
+    @classmethod
+    def fromframe(cls, frame):
+        """Return a :class:`CallerInfo` describing *frame*."""
+        code = frame.f_code
+        if usequalname:
+            return cls(code, frame.f_lineno, frame.f_lasti)
+        return cls(code, frame.f_lineno, frame.f_lasti, receiver(frame))
+
+    def key(self):
+        """Return a key identifying this call site and receiver class."""
+        return (self.code, self.lasti, self.cls)
+
+    def funcname(self):
+        """Return the name of the calling function (see :func:`codefunc`)."""
+        return codefunc(self.code, self.cls)
+
+    def __repr__(self):
+        return "<CallerInfo %s:%d %s>" % (self.filename, self.lineno,
+            self.code.co_name)
+
+def callerinfo(frame, skip=None, stacklevel=1):
+    """Return a :class:`CallerInfo` for the first non-logging frame from *frame*.
+
+    This is like the fast mode of :func:`callingframe`, but the result
+    doesn't refer to the frame. Returns None if every frame is skipped.
+    """
+    frame = callingframe(frame, fast=True, skip=skip, stacklevel=stacklevel)
+    if frame is None:
+        return None
+    try:
+        return CallerInfo.fromframe(frame)
+    finally:
+        del(frame)
+
+def framefunc(frame):
+    """Return a string representation of the code object at *frame*.
+
+    *frame* should be a :class:`CallerInfo`. For compatibility, it may also
+    be a Python interpreter stack frame with a current code object (or a
+    sequence with such a frame as its first element).
+    :meth:`framefunc` will try to determine where the calling function was
+    defined; if the function was defined in a class (as with properties,
+    methods and classmethods), the class' name will be prepended to the function
+    name (like *class.function*). When :data:`usequalname` is set, the code
+    object's qualified name is used instead, which also names the class of
+    static methods.
+    """
+    if isinstance(frame, CallerInfo):
+        return codefunc(frame.code, frame.cls)
+    if not isinstance(frame, types.FrameType):
+        frame = frame[0]
+    if usequalname:
+        return codefunc(frame.f_code)
+    return codefunc(frame.f_code, receiver(frame))
+
+def resolve(callers):
+    """Return the filename, line number and function name of many callers.
+
+    Each item in *callers* may be a :class:`CallerInfo`, a frame, a
+    :class:`logging.LogRecord` or a (code, lineno) or (code, lineno, cls)
+    tuple. The result is a list holding a (filename, lineno, funcName) tuple
+    for each item, in order. Filenames are normalized by :func:`normfile`,
+    except for placeholders like '(unknown file)'.
+    Each distinct call site is resolved only once, no matter how many items
+    share it, so a buffer of records from a few call sites can be resolved
+    cheaply. Records whose 'funcName' is a :class:`FuncName` get the
+    resolved name, too, so that formatting them later is free::
+
+        resolve(handler.buffer)
+    """
+    sites = {}
+    names = {}
+    results = []
+    append = results.append
+    LogRecord = logging.LogRecord
+    for caller in callers:
+        if isinstance(caller, LogRecord):
+            funcName = caller.funcName
+            if isinstance(funcName, FuncName):
+                key = (funcName.code, funcName.cls)
+                name = names.get(key)
+                if name is None:
+                    name = names[key] = str(funcName)
+                funcName.name = funcName = name
+            pathname = caller.pathname
+            # Leave placeholders like "(unknown file)" alone.
+            if pathname and not pathname.startswith("("):
+                pathname = normfile(pathname)
+            append((pathname, caller.lineno, funcName))
+            continue
+        if isinstance(caller, CallerInfo):
+            key = (caller.code, caller.lineno, caller.cls)
+        elif isinstance(caller, types.FrameType):
+            code = caller.f_code
+            if usequalname:
+                key = (code, caller.f_lineno, None)
+            else:
+                key = (code, caller.f_lineno, receiver(caller))
+        elif len(caller) == 2:
+            key = (caller[0], caller[1], None)
+        else:
+            key = tuple(caller)
+        site = sites.get(key)
+        if site is None:
+            code, lineno, cls = key
+            name = names.get((code, cls))
+            if name is None:
+                name = names[code, cls] = codefunc(code, cls)
+            site = sites[key] = (normfile(code.co_filename), lineno, name)
+        append(site)
+    return results
+
+# Code flags set on functions that take *args or **kwargs, and on coroutine
+# functions defined with 'async def'.
+CO_VARARGS = 0x0004
+CO_VARKEYWORDS = 0x0008
+CO_COROUTINE = 0x0080
+
+# Argument extraction plans, keyed by code object.
+argplans = LRUCache()
+
+def argplan(code):
+    """Return the names of *code*'s arguments.
+
+    The result is a tuple of (name, prefix) pairs in the order the arguments
+    were declared, where prefix is '*' or '**' for variable arguments and ''
+    otherwise. Plans are cached in :data:`argplans`, so each code object is
+    only examined once.
+    """
+    plan = argplans.get(code)
+    if plan is not None:
+        return plan
+    names = code.co_varnames
+    count = code.co_argcount + getattr(code, "co_kwonlyargcount", 0)
+    plan = [(name, "") for name in names[:count]]
+    if code.co_flags & CO_VARARGS:
+        plan.append((names[count], "*"))
+        count += 1
+    if code.co_flags & CO_VARKEYWORDS:
+        plan.append((names[count], "**"))
+    plan = tuple(plan)
+    argplans.set(code, plan)
+    return plan
+
+class ArgRef(weakref.ref):
+    """A weak reference to an argument kept by a :class:`FuncArgs`."""
+    __slots__ = ()
+
+class ArgText(str):
+    """The shortened repr of an argument a :class:`FuncArgs` didn't keep."""
+    __slots__ = ()
+
+    def __repr__(self):
+        return str(self)
+
+class FuncArgs(object):
+    """The arguments of a function call, rendered only when used as a string.
+
+    *plan* is the result of :func:`argplan` for the function's code, and
+    *values* holds the corresponding values. When converted to a string,
+    :class:`FuncArgs` looks like *name=value, \*args=value*, with each value
+    shortened by :attr:`repr` (a :class:`reprlib.Repr` instance). Values are
+    not rendered until then, so large arguments cost nothing unless a
+    :class:`logging.Formatter` asks for them.
+
+    Records can outlive the call they were logged from, in a
+    :class:`logging.handlers.MemoryHandler` for instance, so
+    :meth:`fromframe` doesn't keep the arguments themselves alive (see
+    :meth:`hold`). An argument that's gone by the time the record is
+    formatted is shown as '<gone>'.
+    """
+    __slots__ = ("plan", "values", "text")
+    repr = reprlib.Repr()
+    repr.maxstring = repr.maxother = 80
+    # Types whose values are small enough to keep.
+    scalars = frozenset([bool, int, float, complex, type(None)])
+
+    def __init__(self, plan, values):
+        self.plan = plan
+        self.values = values
+        self.text = None
+
+    @classmethod
+    def fromframe(cls, frame):
+        """Return a :class:`FuncArgs` for the current arguments at *frame*."""
+        plan = argplan(frame.f_code)
+        if not plan:
+            return cls(plan, ())
+        if speedups is not None:
+            names = tuple([name for name, _ in plan])
+            values = speedups.arguments(frame, names, NoMatch)
+        else:
+            local = frame.f_locals
+            values = [local.get(name, NoMatch) for name, _ in plan]
+        return cls(plan, tuple([cls.hold(value) for value in values]))
+
+    @classmethod
+    def hold(cls, value):
+        """Return what :meth:`fromframe` keeps of the argument *value*.
+
+        Numbers and None are kept as they are, and strings too, except that
+        only the ends of a long string (all that :attr:`repr` shows) are kept.
+        Other objects are kept through an :class:`ArgRef` if they can be
+        weakly referenced. The rest, like containers, are rendered right
+        away, as an :class:`ArgText`.
+        """
+        kind = type(value)
+        if kind in cls.scalars or value is NoMatch:
+            return value
+        if kind is str or kind is bytes:
+            size = max(cls.repr.maxstring, cls.repr.maxother)
+            if len(value) > 2 * size:
+                value = value[:size] + value[-size:]
+            return value
+        try:
+            return ArgRef(value)
+        except TypeError:
+            return ArgText(cls.repr.repr(value))
+
+    def items(self):
+        """Return a list of (name, value) pairs, skipping deleted arguments."""
+        items = []
+        for (name, prefix), value in zip(self.plan, self.values):
+            if value is NoMatch:
+                continue
+            if type(value) is ArgRef:
+                value = value()
+                if value is None:
+                    value = ArgText("<gone>")
+            items.append((prefix + name, value))
+        return items
+
+    def __str__(self):
+        text = self.text
+        if text is None:
+            text = self.text = ", ".join(["%s=%s" % (name, self.repr.repr(value))
+                for name, value in self.items()])
+        return text
+
+    def __repr__(self):
+        return "<FuncArgs %s>" % self
+
+    def __reduce__(self):
+        return (str, (str(self),))
+
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    monotonic = time.time
+
+class Sampler(object):
+    """Decides which records from each call site a :class:`StackLogger` keeps.
+
+    Call sites are identified by a code object and a line number. For each
+    site, :class:`Sampler` counts the records it kept and dropped. Subclasses
+    implement the policy in :meth:`keep`. Counters are updated without
+    locking and may be slightly off when many threads log from the same site
+    at once.
+    """
+
+    def __init__(self):
+        self.kept = {}
+        self.dropped = {}
+
+    def sample(self, code, lineno):
+        """Return True if a record from *code* at *lineno* should be kept."""
+        key = (code, lineno)
+        if self.keep(key):
+            counts = self.kept
+        else:
+            counts = self.dropped
+        counts[key] = counts.get(key, 0) + 1
+        return counts is self.kept
+
+    def keep(self, key):
+        """Return True if the next record from call site *key* should be kept."""
+        raise NotImplementedError
+
+    def clear(self):
+        """Forget all call sites and counters."""
+        self.kept.clear()
+        self.dropped.clear()
+
+    def stats(self):
+        """Return a dictionary of total and per-site (kept, dropped) counts.
+
+        Sites are identified by a (filename, line number, function name)
+        tuple.
+        """
+        kept, dropped = dict(self.kept), dict(self.dropped)
+        sites = {}
+        for key in set(kept) | set(dropped):
+            code, lineno = key
+            site = (code.co_filename, lineno, codefunc(code))
+            sites[site] = (kept.get(key, 0), dropped.get(key, 0))
+        return dict(
+            kept=sum(kept.values()),
+            dropped=sum(dropped.values()),
+            sites=sites,
+        )
+
+class RandomSampler(Sampler):
+    """Keep each record with a fixed *probability* (for example, 0.01 keeps 1 in 100)."""
+
+    def __init__(self, probability):
+        import random
+        Sampler.__init__(self)
+        self.probability = probability
+        self.random = random.random
+
+    def keep(self, key):
+        return self.random() < self.probability
+
+class TokenBucketSampler(Sampler):
+    """Keep at most *rate* records per second from each call site.
+
+    Each site starts with *burst* tokens (or *rate* tokens, if *burst* is
+    None) and gains *rate* tokens per second, up to *burst*. A record is kept
+    if it can spend a token.
+    """
+
+    def __init__(self, rate, burst=None):
+        Sampler.__init__(self)
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.buckets = {}
+
+    def keep(self, key):
+        now = monotonic()
+        try:
+            tokens, last = self.buckets[key]
+        except KeyError:
+            tokens, last = self.burst, now
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self.buckets[key] = (tokens, now)
+            return False
+        self.buckets[key] = (tokens - 1, now)
+        return True
+
+    def clear(self):
+        Sampler.clear(self)
+        self.buckets.clear()
+
+class CallPath(object):
+    """A chain of calls, rendered only when used as a string.
+
+    *keys* is a tuple of (code, cls) pairs (see :func:`codefunc`), from the
+    outermost call to the innermost. When converted to a string, the
+    :class:`CallPath` looks like *A.f > B.g > C.h*. Use :meth:`intern` to
+    get a shared instance for *keys*, so that the string is only built once.
+    """
+    __slots__ = ("keys", "text")
+    separator = " > "
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.text = None
+
+    @classmethod
+    def intern(cls, keys):
+        """Return the shared :class:`CallPath` for *keys* from :data:`callpaths`."""
+        path = callpaths.get(keys)
+        if path is None:
+            path = cls(keys)
+            callpaths.set(keys, path)
+        return path
+
+    @classmethod
+    def fromframe(cls, frame, depth, skip=None):
+        """Return the :class:`CallPath` for up to *depth* frames from *frame*.
+
+        Logging-related frames are skipped according to *skip* (see
+        :func:`callingframe`).
+        """
+        if skip is None:
+            skip = skipped
+        decisions = skip.decisions
+        keys = []
+        while frame is not None and len(keys) < depth:
+            skips = decisions.get(frame.f_code.co_filename)
+            if skips is None:
+                skips = skip.skips(frame)
+            if not skips:
+                if usequalname:
+                    keys.append((frame.f_code, None))
+                else:
+                    keys.append((frame.f_code, receiver(frame)))
+            frame = frame.f_back
+        keys.reverse()
+        return cls.intern(tuple(keys))
+
+    def names(self):
+        """Return the name of each call in the path."""
+        return [codefunc(code, cls) for code, cls in self.keys]
+
+    def __str__(self):
+        text = self.text
+        if text is None:
+            text = self.text = self.separator.join(self.names())
+        return text
+
+    def __repr__(self):
+        return "<CallPath %s>" % self
+
+    def __reduce__(self):
+        return (str, (str(self),))
+
+# Shared CallPath instances, keyed by their keys.
+callpaths = LRUCache()
+
+# Information that StackLogger.findCaller found for the next record made in
+# each thread.
+pending = threading.local()
+
+# The names of asyncio tasks and their coroutines, keyed by task.
+tasknames = weakref.WeakKeyDictionary()
+
+def taskinfo():
+    """Return information about the current :mod:`asyncio` task.
+
+    The result is a tuple of the task's name, the qualified name of its
+    coroutine and the coroutine's code object, or None if no task is running.
+    Results are cached for each task in :data:`tasknames`, so later calls
+    from the same task cost a single dictionary lookup.
+    """
+    # If asyncio hasn't been imported, there can't be any tasks.
+    asyncio = sys.modules.get("asyncio")
+    if asyncio is None:
+        return None
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        # There's no running event loop.
+        return None
+    if task is None:
+        return None
+    try:
+        return tasknames[task]
+    except KeyError:
+        pass
+    # Tasks only have names, and get_coro(), on Python 3.8 and newer.
+    getcoro = getattr(task, "get_coro", None)
+    if getcoro is not None:
+        coro = getcoro()
+    else:
+        coro = getattr(task, "_coro", None)
+    code = getattr(coro, "cr_code", None)
+    qualname = getattr(coro, "__qualname__", None)
+    if qualname is not None:
+        qualname = shortqualname(qualname)
+    getname = getattr(task, "get_name", None)
+    name = getname() if getname is not None else None
+    info = tasknames[task] = (name, qualname, code)
+    return info
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time
+
+class Histogram(object):
+    """Counts of observed durations (in seconds), grouped into buckets.
+
+    Each bucket counts the observations no greater than its upper bound,
+    like a Prometheus histogram; the last bucket is unbounded.
+    """
+    bounds = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 1e-3, float("inf"))
+
+    def __init__(self):
+        self.counts = [0] * len(self.bounds)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        """Add an observation of *seconds*."""
+        for i, bound in enumerate(self.bounds):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+
+    def snapshot(self):
+        """Return the histogram as a dictionary with cumulative bucket counts."""
+        buckets = []
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            buckets.append((bound, total))
+        return dict(count=self.count, sum=self.sum, buckets=buckets)
+
+try:
+    replace = os.replace
+except AttributeError:
+    def replace(src, dst):
+        """Rename file *src* to *dst*, replacing *dst* if it exists."""
+        # Python 2 can't replace files on Windows, so this isn't atomic there.
+        if os.name == "nt" and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+class Instruments(object):
+    """Counters and sampled timings for :class:`StackLogger`'s caller resolution.
+
+    Every record is counted, but only one in every *every* records is timed
+    and has its walked frames counted, so that the instruments can stay
+    enabled in production. Install an :class:`Instruments` with
+    :func:`instrument`. Counters are updated without locking and may be
+    slightly off when many threads log at once. The 'callingframe' timings
+    cover the walk to the calling frame and the 'framefunc' timings cover
+    resolving its call site, but not capturing arguments, call paths or
+    stacks.
+
+    The statistics of the module's caches and of the shared
+    :attr:`StackLogger.callsites` are reported, along with those of the
+    caches in the dictionary *caches*, such as a single logger's
+    :attr:`StackLogger.callsites`, keyed by the names to report them under.
+    """
+
+    def __init__(self, every=100, caches=None):
+        self.every = every
+        self.caches = dict(caches or ())
+        self.records = 0
+        self.sampled = 0
+        self.frames = 0
+        self.fallbacks = 0
+        self.timings = dict(callingframe=Histogram(), framefunc=Histogram())
+
+    def sample(self):
+        """Count a record and return True if it should be timed."""
+        self.records += 1
+        return self.records % self.every == 0
+
+    def walked(self, start, frame):
+        """Count the frames from *start* to *frame* (or to the stack's end)."""
+        count = 0
+        while start is not None and start is not frame:
+            count += 1
+            start = start.f_back
+        self.frames += count
+        self.sampled += 1
+
+    def snapshot(self):
+        """Return the counters, timings and cache statistics as a dictionary."""
+        caches = dict(qualnames=qualnames, callpaths=callpaths,
+            argplans=argplans)
+        if StackLogger.callsites is not None:
+            caches["callsites"] = StackLogger.callsites
+        caches.update(self.caches)
+        return dict(
+            records=self.records,
+            sampled=self.sampled,
+            frames_per_record=self.sampled and
+                float(self.frames) / self.sampled or 0.0,
+            fallbacks=self.fallbacks,
+            timings=dict([(name, histogram.snapshot())
+                for name, histogram in self.timings.items()]),
+            caches=dict([(name, cache.stats())
+                for name, cache in caches.items()]),
+        )
+
+    def prometheus(self, prefix="stacklogger"):
+        """Return a snapshot in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+        def metric(name, kind, value, labels=""):
+            if kind:
+                lines.append("# TYPE %s_%s %s" % (prefix, name, kind))
+            lines.append("%s_%s%s %r" % (prefix, name, labels, value))
+        metric("records_total", "counter", snapshot["records"])
+        metric("sampled_records_total", "counter", snapshot["sampled"])
+        metric("frames_per_record", "gauge", snapshot["frames_per_record"])
+        metric("heuristic_fallbacks_total", "counter", snapshot["fallbacks"])
+        lines.append("# TYPE %s_seconds histogram" % prefix)
+        for phase, histogram in sorted(snapshot["timings"].items()):
+            for bound, count in histogram["buckets"]:
+                le = bound == float("inf") and "+Inf" or repr(bound)
+                metric("seconds_bucket", None, count,
+                    '{phase="%s",le="%s"}' % (phase, le))
+            metric("seconds_sum", None, histogram["sum"],
+                '{phase="%s"}' % phase)
+            metric("seconds_count", None, histogram["count"],
+                '{phase="%s"}' % phase)
+        caches = sorted(snapshot["caches"].items())
+        for family, key in (("cache_hit_ratio", "hitrate"),
+                ("cache_size", "size")):
+            lines.append("# TYPE %s_%s gauge" % (prefix, family))
+            for name, stats in caches:
+                metric(family, None, stats[key], '{cache="%s"}' % name)
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, prefix="stacklogger"):
+        """Write :meth:`prometheus` output to the file at *path*.
+
+        The file is replaced atomically, so a collector never reads a
+        partial snapshot.
+        """
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "w") as f:
+            f.write(self.prometheus(prefix))
+        replace(tmp, path)
+
+# The active Instruments, if any. See instrument().
+instruments = None
+
+def instrument(every=100, caches=None):
+    """Start instrumenting caller resolution and return the :class:`Instruments`.
+
+    One in every *every* records is timed, and the named *caches* are
+    reported too (see :class:`Instruments`)::
+
+        instrument(caches={"api_callsites": api_log.callsites})
+
+    Call :func:`instrument` with *every* set to None to stop.
+    """
+    global instruments
+    if every is None:
+        instruments = None
+    else:
+        instruments = Instruments(every, caches)
+    return instruments
+
+def formatstack(frame):
+    """Format the stack leading to *frame* like :meth:`logging.Logger.findCaller`."""
+    import traceback
+    lines = traceback.format_stack(frame)
+    return "Stack (most recent call last):\n" + "".join(lines).rstrip("\n")
+
+# The record attributes that describe a call site.
+SITEFIELDS = ("pathname", "filename", "module", "lineno", "funcName")
+
+# Site numbers are unique within a process, so that a listener can tell apart
+# the sites of several SiteQueueHandlers sharing a queue.
+sitenumbers = count()
+
+def sitekey(record):
+    """Return a key identifying the call site that logged *record*.
+
+    A lazy :class:`FuncName` is keyed by its code and class, so the key can
+    be made without resolving the name.
+    """
+    funcName = record.funcName
+    if isinstance(funcName, FuncName):
+        return (record.pathname, record.lineno, funcName.code, funcName.cls)
+    return (record.pathname, record.lineno, funcName)
+
+def sitequeue():
+    """Define :class:`SiteQueueHandler` and :class:`SiteQueueListener`.
+
+    Both extend classes from :mod:`logging.handlers`, which is only imported
+    when one of them is first used.
+    """
+    import logging.handlers
+
+    class SiteQueueHandler(getattr(logging.handlers, "QueueHandler", object)):
+        """A :class:`logging.handlers.QueueHandler` that sends call sites by number.
+
+        Each distinct call site (a pathname, line number and function name) is
+        numbered the first time a record from it is queued, from
+        :data:`sitenumbers`, which all handlers in a process share. Queued
+        records carry the number in a 'site' attribute instead of their
+        'pathname', 'filename', 'module', 'lineno' and 'funcName' attributes;
+        the first record from each site also carries a 'siteDef' attribute
+        with the site's description. A :class:`SiteQueueListener` rebuilds the
+        original attributes.
+
+        With :attr:`StackLogger.lazy`, a site's function name is resolved once,
+        when the site is first queued, instead of once per record. A site is
+        only numbered once its definition has been queued; call :meth:`resend`
+        after replacing the listener.
+        """
+
+        def __init__(self, queue):
+            logging.handlers.QueueHandler.__init__(self, queue)
+            self.sites = {}
+            self.pid = os.getpid()
+
+        def resend(self):
+            """Send each site's definition again with its next record."""
+            self.sites.clear()
+
+        def emit(self, record):
+            key = sitekey(record)
+            try:
+                prepared = self.prepare(record)
+                try:
+                    self.enqueue(prepared)
+                except Exception:
+                    # The definition was lost, e.g. to a full queue, so the
+                    # next record from this site has to carry it instead.
+                    if "siteDef" in prepared.__dict__:
+                        self.sites.pop(key, None)
+                    raise
+            except Exception:
+                self.handleError(record)
+
+        def prepare(self, record):
+            record = logging.handlers.QueueHandler.prepare(self, record)
+            # A forked child's listener hasn't seen its parent's definitions.
+            pid = os.getpid()
+            if pid != self.pid:
+                self.sites.clear()
+                self.pid = pid
+            key = sitekey(record)
+            site = self.sites.get(key)
+            if site is None:
+                site = self.sites[key] = next(sitenumbers)
+                record.siteDef = (record.pathname, record.lineno,
+                    str(record.funcName))
+            attrs = record.__dict__
+            for name in SITEFIELDS:
+                attrs.pop(name, None)
+            record.site = site
+            # The listener tells producers apart by their process IDs.
+            if record.process is None:
+                record.process = pid
+            return record
+
+    class SiteQueueListener(getattr(logging.handlers, "QueueListener", object)):
+        """A :class:`logging.handlers.QueueListener` for a :class:`SiteQueueHandler`.
+
+        The listener remembers the sites defined by each producing process in
+        :attr:`sites` and restores the call site attributes of each record
+        before handling it.
+        """
+
+        def __init__(self, queue, *handlers, **kwargs):
+            logging.handlers.QueueListener.__init__(self, queue, *handlers, **kwargs)
+            self.sites = {}
+
+        def prepare(self, record):
+            attrs = record.__dict__
+            site = attrs.pop("site", None)
+            if site is None:
+                return record
+            key = (record.process, site)
+            definition = attrs.pop("siteDef", None)
+            if definition is not None:
+                self.sites[key] = definition
+            pathname, lineno, funcName = self.sites.get(key,
+                ("(unknown file)", 0, "(unknown function)"))
+            record.pathname = pathname
+            record.filename = os.path.basename(pathname)
+            record.module = os.path.splitext(record.filename)[0]
+            record.lineno = lineno
+            record.funcName = funcName
+            return record
+
+    for cls in (SiteQueueHandler, SiteQueueListener):
+        cls.__qualname__ = cls.__name__
+        globals()[cls.__name__] = cls
+
+def __getattr__(name):
+    if name in ("SiteQueueHandler", "SiteQueueListener"):
+        sitequeue()
+        return globals()[name]
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+# Modules can't define __getattr__ before Python 3.7.
+if sys.version_info < (3, 7):
+    sitequeue()
+
+class JSONFormatter(logging.Formatter):
+    """A :class:`logging.Formatter` that formats each record as a JSON object.
+
+    The object holds the record's 'created', 'levelname', 'name' and
+    'message' attributes, its call site ('funcName', 'pathname' and
+    'lineno'), any of the 'funcArgs', 'callPath', 'taskName' and 'coroName'
+    attributes added by :class:`StackLogger`, the attributes named in
+    *fields* and, if present, the formatted exception ('exc_info') and stack
+    ('stack_info').
+
+    Each call site is encoded once and kept in :attr:`sites`, an
+    :class:`LRUCache` holding up to *maxsize* sites; each logger and level
+    name pair is encoded once, too. Only the timestamp, message and captured
+    context are encoded for every record.
+    """
+    context = ("funcArgs", "callPath", "taskName", "coroName")
+
+    def __init__(self, fields=(), maxsize=4096):
+        import json
+        logging.Formatter.__init__(self)
+        self.dumps = json.dumps
+        self.quote = json.encoder.encode_basestring_ascii
+        self.fields = [(', %s: ' % self.quote(name), name) for name in fields]
+        self.sites = LRUCache(maxsize=maxsize)
+        self.names = {}
+
+    def format(self, record):
+        quote = self.quote
+        key = sitekey(record)
+        site = self.sites.get(key)
+        if site is None:
+            site = '"funcName": %s, "pathname": %s, "lineno": %d' % (
+                quote(str(record.funcName)), quote(record.pathname),
+                record.lineno)
+            self.sites.set(key, site)
+        key = (record.name, record.levelname)
+        names = self.names.get(key)
+        if names is None:
+            names = self.names[key] = '"levelname": %s, "name": %s' % (
+                quote(record.levelname), quote(record.name))
+        record.message = record.getMessage()
+
+        extra = ""
+        attrs = record.__dict__
+        for name in self.context:
+            value = attrs.get(name)
+            if value is not None:
+                extra += ', "%s": %s' % (name, quote(str(value)))
+        for prefix, name in self.fields:
+            if name in attrs:
+                extra += prefix + self.dumps(attrs[name], default=str)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            extra += ', "exc_info": ' + quote(record.exc_text)
+        stack_info = getattr(record, "stack_info", None)
+        if stack_info:
+            extra += ', "stack_info": ' + quote(stack_info)
+        return '{"created": %r, %s, "message": %s, %s%s}' % (record.created,
+            names, quote(record.message), site, extra)
+
 class StackLogger(logging.Logger):
     """A logging channel.
 
@@ -87,21 +1603,192 @@ class StackLogger(logging.Logger):
     :class:`logging.LogRecord`, adding useful information like the class where
     a method was defined to the standard :class:`logging.Formatter` 'funcName'
     attribute.
+
+    If :attr:`callsites` is an :class:`LRUCache`, the results of
+    :meth:`findCaller` are cached for each call site (a code object and the
+    offset of its last instruction) and logger mode. Later records from the
+    same call site skip name resolution entirely. Set it on :class:`StackLogger` to share one
+    cache between all loggers, or on a single logger to give it its own cache.
+    Since a reloaded module gets new code objects, clear the cache after
+    reloading code to release the old entries::
+
+        StackLogger.callsites = LRUCache(maxsize=20000)
+
+    Frames are skipped according to :attr:`skip`, a :class:`SkipRules`
+    instance. By default, all loggers share :data:`skipped`; to skip a
+    wrapper for just one logger, give it its own rules::
+
+        log.skip = skipped.copy()
+        log.skip.addpackage("myproject.logutil")
+
+    If :attr:`lazy` is True, records get a :class:`FuncName` instead of a
+    string in their 'funcName' attribute. Records that are never formatted
+    (because a handler or filter drops them) then never pay for resolving
+    the name.
+
+    If :attr:`coroutines` is True, records logged from an :mod:`asyncio`
+    task get 'taskName' and 'coroName' attributes naming the task and its
+    coroutine (or None outside a task). Records logged directly by a task's
+    coroutine take their 'funcName' from the coroutine, too, rather than from
+    guessing. Task information is cached for each task (see
+    :func:`taskinfo`).
+
+    If :attr:`captureargs` is True, records get a 'funcArgs' attribute
+    holding the caller's arguments as a :class:`FuncArgs`, which can be used
+    in format strings like '%(funcName)s(%(funcArgs)s)'.
+
+    If :attr:`callpath` is greater than zero, records get a 'callPath'
+    attribute holding a :class:`CallPath` of up to that many calls leading
+    to the record.
+
+    If :attr:`sampler` is a :class:`Sampler`, it decides which records to
+    keep from each call site before the stack is inspected or a record is
+    made. A dropped record costs only a short walk to the calling frame and
+    the sampler's decision::
+
+        log.sampler = TokenBucketSampler(rate=10)
+
+    If :attr:`depths` is a dict, the logger learns how many frames lie
+    between each logging method and the code that called it, and later
+    jumps straight to the caller's frame after checking that the frame below
+    it still runs the same code (see :func:`jumpframe`). Records with a
+    *stacklevel* other than one always walk the stack::
+
+        log.depths = {}
     """
+    sampler = None
+    callsites = None
+    skip = None
+    lazy = False
+    coroutines = False
+    captureargs = False
+    callpath = 0
+    depths = None
 
-    def findCaller(self):
-        """Return the filename, line number and function name of the caller's frame."""
-        frame = inspect.currentframe()
+    def findCaller(self, stack_info=False, stacklevel=1):
+        """Return the filename, line number and function name of the caller's frame.
+
+        The caller is the *stacklevel*-th frame that isn't skipped (see
+        :func:`callingframe`), so that logging helpers can attribute records
+        to their own callers. Python 3.2 and newer expect a fourth item in
+        the result: the formatted stack, if *stack_info* is True, or None.
+        Older versions call :meth:`findCaller` without arguments and get
+        only three items.
+        """
+        frame = sys._getframe()
         filename = "(unknown file)"
         lineno = 0
         funcName = "(unknown function)"
+        sinfo = None
+        inst = instruments
+        timed = inst is not None and inst.sample()
+        start = None
         try:
-            frame = callingframe(frame)
-            funcName = framefunc(frame)
-            filename, lineno = frame[1:3]
+            if timed:
+                start, began = frame, clock()
+            if self.depths is not None and stacklevel == 1:
+                # findCaller() <- Logger._log() <- _log() <- entry point
+                frame = jumpframe(self.depths, 3, self.skip)
+            else:
+                frame = callingframe(frame, fast=True, skip=self.skip,
+                    stacklevel=stacklevel)
+            if timed:
+                walked = resolved = clock()
+            if frame is not None:
+                filename, lineno, funcName = \
+                    self.callsite(CallerInfo.fromframe(frame))
+                if timed:
+                    resolved = clock()
+                if self.captureargs:
+                    pending.funcArgs = FuncArgs.fromframe(frame)
+                if self.callpath > 0:
+                    pending.callPath = CallPath.fromframe(frame,
+                        self.callpath, self.skip)
+                if stack_info:
+                    sinfo = formatstack(frame)
+            if timed:
+                inst.timings["callingframe"].observe(walked - began)
+                inst.timings["framefunc"].observe(resolved - walked)
+                inst.walked(start, frame)
         finally:
             # Make sure we don't leak a reference to the frame to prevent a
             # reference cycle.
-            del(frame)
+            del(frame, start)
+
+        result = (filename, lineno, funcName)
+        if sys.version_info >= (3, 2):
+            result += (sinfo,)
+        return result
+
+    def _log(self, level, msg, args, *rest, **kwargs):
+        """Log a record, unless :attr:`sampler` drops it first."""
+        sampler = self.sampler
+        if sampler is not None:
+            # _log(level, msg, args, exc_info, extra, stack_info, stacklevel)
+            if len(rest) > 3:
+                stacklevel = rest[3]
+            else:
+                stacklevel = kwargs.get("stacklevel", 1)
+            if self.depths is not None and stacklevel == 1:
+                frame = jumpframe(self.depths, 1, self.skip)
+            else:
+                frame = callingframe(sys._getframe(1), fast=True,
+                    skip=self.skip, stacklevel=stacklevel)
+            try:
+                if frame is not None and \
+                        not sampler.sample(frame.f_code, frame.f_lineno):
+                    return
+            finally:
+                del(frame)
+        try:
+            return logging.Logger._log(self, level, msg, args, *rest, **kwargs)
+        finally:
+            # makeRecord() takes these, unless something raised first.
+            if self.captureargs or self.callpath > 0:
+                pending.funcArgs = pending.callPath = None
+
+    def makeRecord(self, *args, **kwargs):
+        """Make a :class:`logging.LogRecord` with any extra attributes requested."""
+        record = logging.Logger.makeRecord(self, *args, **kwargs)
+        if self.captureargs:
+            record.funcArgs = getattr(pending, "funcArgs", None)
+            pending.funcArgs = None
+        if self.callpath > 0:
+            record.callPath = getattr(pending, "callPath", None)
+            pending.callPath = None
+        if self.coroutines:
+            info = taskinfo()
+            if info is None:
+                record.taskName = record.coroName = None
+            else:
+                record.taskName, record.coroName = info[:2]
+        return record
+
+    def callsite(self, caller):
+        """Return the filename, line number and function name for *caller*.
+
+        *caller* is a :class:`CallerInfo`. Cached results are keyed by the
+        logger's :attr:`lazy` and :attr:`coroutines` settings too, since
+        they change the function name.
+        """
+        callsites = self.callsites
+        if callsites is None:
+            return (caller.filename, caller.lineno, self.funcname(caller))
+
+        key = caller.key() + (self.lazy, self.coroutines)
+        site = callsites.get(key)
+        if site is None:
+            site = (caller.filename, caller.lineno, self.funcname(caller))
+            callsites.set(key, site)
+        return site
 
-        return (os.path.normcase(filename), lineno, funcName)
+    def funcname(self, caller):
+        """Return the function name (or a :class:`FuncName`) for *caller*."""
+        code = caller.code
+        if self.coroutines and code.co_flags & CO_COROUTINE:
+            info = taskinfo()
+            if info is not None and info[2] is code:
+                return info[1]
+        if self.lazy:
+            return FuncName(code, caller.cls)
+        return codefunc(code, caller.cls)
@@ -1,11 +1,27 @@
+import asyncio
+import functools
+import gc
 import inspect
+import json
 import logging
 import logging.handlers
 import os
+import pickle
+import queue
+import shutil
 import sys
+import tempfile
+import threading
+import tracemalloc
+import types
 import unittest
+import weakref
 
-from stacklogger import StackLogger, callingframe, framefunc, srcfile
+import stacklogger
+from stacklogger import StackLogger, FrontCache, LRUCache, SkipRules, \
+    callingframe, framefunc, srcfile
+
+speedups = stacklogger.speedups
 
 logging.logMultiprocessing = False
 logging.setLoggerClass(StackLogger)
@@ -56,6 +72,59 @@ class FakeFrames(object):
         log.debug("in FakeFrames.fake_staticmethod")
         return currentframe()
 
+class FakeCallers(object):
+
+    def outer(self):
+        return self.inner()
+
+    def inner(self):
+        return fake_function()
+
+def fake_level1():
+    fake_level2()
+
+def fake_level2():
+    log = logging.getLogger("fakes")
+    log.debug("in fake_level2", stacklevel=FakeLevels.level)
+
+class FakeLevels(object):
+    level = 1
+
+    def fake_method(self):
+        fake_level1()
+
+    @property
+    def fake_property(self):
+        fake_level1()
+
+    @classmethod
+    def fake_classmethod(cls):
+        fake_level1()
+
+    @staticmethod
+    def fake_staticmethod():
+        fake_level1()
+
+def fake_level_function():
+    fake_level1()
+
+fake_level_lambda = lambda: fake_level1()
+
+class FakeTasks(object):
+
+    async def fake_coroutine(self):
+        log = logging.getLogger("fakes")
+        log.debug("in FakeTasks.fake_coroutine")
+        return currentframe()
+
+    async def fake_awaiter(self):
+        await self.fake_coroutine()
+
+def fake_arguments(a, b=2, *args, **kwargs):
+    log = logging.getLogger("fakes")
+    log.debug("in fake_arguments")
+    return currentframe()
+
 def fake_function():
     log = logging.getLogger("fakes")
     log.debug("in fake_function")
@@ -64,6 +133,36 @@ def fake_function():
 fake_lambda = lambda: logging.getLogger("fakes").debug("in fake_lambda") \
     or currentframe()
 
+def fake_decorator(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        log = logging.getLogger("fakes")
+        log.debug("in wrapper")
+        func(*args, **kwargs)
+        return currentframe()
+    return wrapper
+
+class FakeDecoratedA(object):
+
+    @fake_decorator
+    def fake_foo(self):
+        pass
+
+class FakeDecoratedB(object):
+
+    @fake_decorator
+    def fake_bar(self):
+        pass
+
+    fake_helper = fake_function
+
+class FakeOuter(object):
+
+    class FakeInner(object):
+
+        def fake_method(self):
+            return currentframe()
+
 class BaseTest(unittest.TestCase):
 
     def setUp(self):
@@ -87,11 +186,227 @@ class TestUtils(BaseTest):
         self.assertModuleFileIs(srcfile("foo.pyo"), "foo.py")
         self.assertModuleFileIs(srcfile("foo"), "foo")
 
+    def test_normfile(self):
+        fname = os.path.join("somewhere", "foo.py")
+        name = stacklogger.normfile(fname)
+        self.assertEqual(name, srcfile(fname))
+        self.assertTrue(stacklogger.normfile(fname[:]) is name)
+        self.assertEqual(stacklogger.normfile("<string>"), "<string>")
+
+    def test_prewarm(self):
+        stacklogger.filenames.clear()
+        self.assertTrue(stacklogger.prewarm([stacklogger, os, sys]) >= 2)
+        self.assertTrue(stacklogger.__file__ in stacklogger.filenames)
+        self.assertEqual(stacklogger.prewarm([stacklogger]), 0)
+
+    def test_refresh(self):
+        files = stacklogger.skipped.files
+        self.assertTrue(logging._srcfile in files)
+        self.assertTrue(srcfile(stacklogger.__file__) in files)
+        saved = logging._srcfile
+        fake = os.path.normcase(os.path.abspath("fakelogging.py"))
+        logging._srcfile = fake
+        try:
+            stacklogger.refresh()
+            self.assertTrue(fake in files)
+        finally:
+            logging._srcfile = saved
+            files.discard(fake)
+
+    def test_diagnostics(self):
+        handler = logging.handlers.BufferingHandler(10)
+        stacklogger.log.addHandler(handler)
+        stacklogger.log.setLevel(logging.DEBUG)
+        try:
+            stacklogger.classfunc(fake_function.__code__, None)
+            self.assertEqual(len(handler.buffer), 0)
+            stacklogger.diagnostics = True
+            stacklogger.classfunc(fake_function.__code__, None)
+            self.assertEqual(len(handler.buffer), 1)
+        finally:
+            stacklogger.diagnostics = False
+            stacklogger.log.setLevel(logging.NOTSET)
+            stacklogger.log.removeHandler(handler)
+
+    def test_lean_import(self):
+        import subprocess
+        code = ("import sys, stacklogger; "
+            "print(' '.join(sorted(sys.modules)))")
+        output = subprocess.check_output([sys.executable, "-c", code],
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        modules = output.decode().split()
+        for name in ("inspect", "logging.handlers", "random", "json"):
+            self.assertFalse(name in modules, name)
+
+    def test_lazy_sitequeue(self):
+        self.assertTrue(issubclass(stacklogger.SiteQueueHandler,
+            logging.handlers.QueueHandler))
+        self.assertEqual(stacklogger.SiteQueueListener.__qualname__,
+            "SiteQueueListener")
+        self.assertRaises(AttributeError, getattr, stacklogger, "missing")
+
+class TestLRUCache(BaseTest):
+
+    def test_lrucache_counters(self):
+        cache = LRUCache(maxsize=2)
+        self.assertEqual(cache.get("a"), None)
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_lrucache_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertTrue("a" in cache)
+        self.assertFalse("b" in cache)
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(len(cache), 2)
+
+    def test_lrucache_clear(self):
+        cache = LRUCache()
+        cache.set("a", 1)
+        cache.get("a")
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()["hits"], 0)
+
+class TestFrontCache(BaseTest):
+
+    def test_frontcache_get(self):
+        cache = FrontCache()
+        self.assertEqual(cache.get("a"), None)
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        stats = cache.stats()
+        self.assertEqual(stats["fronthits"], 1)
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_frontcache_shared(self):
+        cache = FrontCache()
+        cache.set("a", 1)
+        results = []
+        thread = threading.Thread(target=lambda: results.extend(
+            [cache.get("a"), cache.get("a")]))
+        thread.start()
+        thread.join()
+        self.assertEqual(results, [1, 1])
+        self.assertEqual(cache.shared.hits, 1)
+
+    def test_frontcache_clear(self):
+        cache = FrontCache()
+        cache.set("a", 1)
+        cache.clear()
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_frontcache_maxsize(self):
+        cache = FrontCache(maxsize=2)
+        for key in "abc":
+            cache.set(key, key)
+        self.assertTrue(len(cache.front().data) <= 2)
+        self.assertEqual(cache.get("a"), "a")
+
+    def test_frontcache_threads(self):
+        cache = FrontCache(LRUCache(maxsize=50))
+        errors = []
+        def run(offset):
+            try:
+                for i in range(2000):
+                    key = (offset + i) % 100
+                    value = cache.get(key)
+                    if value is None:
+                        cache.set(key, key)
+                    elif value != key:
+                        errors.append((key, value))
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertTrue(len(cache.shared) <= 50)
+
+    def test_frontcache_stats_threads(self):
+        cache = FrontCache()
+        cache.set("key", "value")
+        done = threading.Event()
+        def start():
+            for _ in range(1000):
+                thread = threading.Thread(target=cache.get, args=("key",))
+                thread.start()
+                thread.join()
+            done.set()
+        starter = threading.Thread(target=start)
+        starter.start()
+        try:
+            while not done.is_set():
+                cache.stats()
+                cache.clear()
+        finally:
+            starter.join()
+
+class TestSkipRules(BaseTest):
+
+    def setUp(self):
+        BaseTest.setUp(self)
+        self.frame = fake_function()
+
+    def test_skiprules_file(self):
+        rules = SkipRules()
+        self.assertFalse(rules.skips(self.frame))
+        rules.addfile(__file__)
+        self.assertTrue(rules.skips(self.frame))
+
+    def test_skiprules_module(self):
+        rules = SkipRules()
+        rules.addmodule("other")
+        self.assertFalse(rules.skips(self.frame))
+        rules.addmodule(__name__)
+        self.assertTrue(rules.skips(self.frame))
+
+    def test_skiprules_package(self):
+        self.assertTrue(SkipRules().decide("foo.py", "foo.bar.baz") is False)
+        for package in ("foo", "foo.bar", "foo.bar.baz"):
+            rules = SkipRules(packages=[package])
+            self.assertTrue(rules.decide("foo.py", "foo.bar.baz"))
+        rules = SkipRules(packages=["foo.ba"])
+        self.assertFalse(rules.decide("foo.py", "foo.bar.baz"))
+
+    def test_skiprules_decisions(self):
+        rules = SkipRules()
+        rules.skips(self.frame)
+        self.assertEqual(rules.decisions, {self.frame.f_code.co_filename: False})
+        rules.addmodule(__name__)
+        self.assertEqual(rules.decisions, {})
+
+    def test_skiprules_copy(self):
+        rules = SkipRules(modules=["foo"])
+        copy = rules.copy()
+        copy.addmodule("bar")
+        self.assertEqual(rules.modules, set(["foo"]))
+        self.assertEqual(copy.modules, set(["foo", "bar"]))
+
+    def test_callingframe_skip(self):
+        rules = stacklogger.skipped.copy()
+        rules.addmodule(__name__)
+        frame = callingframe(self.frame, fast=True, skip=rules)
+        self.assertNotEqual(frame.f_code.co_filename,
+            self.frame.f_code.co_filename)
+
 class TestFrameFuncs(BaseTest):
     infokeys = "frame filename lineno function context index".split()
+    usequalname = stacklogger.usequalname
     
     def setUp(self):
         BaseTest.setUp(self)
+        self.oldusequalname = stacklogger.usequalname
+        stacklogger.usequalname = self.usequalname
         self.frames = dict(
             function=fake_function(),
             _lambda=fake_lambda(),
@@ -112,6 +427,17 @@ class TestFrameFuncs(BaseTest):
             self.frames["class_%smethod" % method] = \
                 getattr(FakeFrames, "fake_%smethod" % method)()
 
+    def tearDown(self):
+        BaseTest.tearDown(self)
+        stacklogger.usequalname = self.oldusequalname
+
+    @property
+    def staticname(self):
+        # Only qualified names know where static methods were defined.
+        if self.usequalname:
+            return "FakeFrames.fake_staticmethod"
+        return "fake_staticmethod"
+
     def callingframe(self, framekey, **expectedkeys):
         result = dict(zip(self.infokeys, callingframe(self.frames[framekey])))
         for k, v in expectedkeys.items():
@@ -120,6 +446,11 @@ class TestFrameFuncs(BaseTest):
             else:
                 self.assertEqual(v, result[k])
 
+    def fastcallingframe(self, framekey, filename, function):
+        frame = callingframe(self.frames[framekey], fast=True)
+        self.assertModuleFileIs(frame.f_code.co_filename, filename)
+        self.assertEqual(frame.f_code.co_name, function)
+
     def framefunc(self, framekey, expectedname):
         self.assertEquals(framefunc(self.frames[framekey]), expectedname)
 
@@ -163,6 +494,59 @@ class TestFrameFuncs(BaseTest):
             filename="tests.py",
             function="fake_staticmethod")
 
+    def test_callingframe_fast_function(self):
+        self.fastcallingframe("function", "tests.py", "fake_function")
+
+    def test_callingframe_fast_method(self):
+        self.fastcallingframe("method", "tests.py", "fake_method")
+
+    def test_callingframe_fast_property(self):
+        self.fastcallingframe("property", "tests.py", "fake_property")
+
+    def test_callingframe_fast_class_classmethod(self):
+        self.fastcallingframe("class_classmethod", "tests.py",
+            "fake_classmethod")
+
+    def test_callingframe_fast_skips_logging(self):
+        frames = []
+        log = logging.getLogger("fakes.skips")
+        def capture(record):
+            # Keep the logging frame that called this filter.
+            frames.append(currentframe().f_back)
+            return False
+        log.addFilter(capture)
+        try:
+            log.warning("in test_callingframe_fast_skips_logging")
+        finally:
+            log.removeFilter(capture)
+        frame = callingframe(frames.pop(), fast=True)
+        self.assertEqual(frame.f_code.co_name,
+            "test_callingframe_fast_skips_logging")
+
+    def callerinfo(self, framekey, function):
+        caller = stacklogger.callerinfo(self.frames[framekey])
+        self.assertModuleFileIs(caller.filename, "tests.py")
+        self.assertEqual(caller.code.co_name, function)
+        self.assertEqual(framefunc(caller),
+            framefunc(callingframe(self.frames[framekey])))
+
+    def test_callerinfo_function(self):
+        self.callerinfo("function", "fake_function")
+
+    def test_callerinfo_method(self):
+        self.callerinfo("method", "fake_method")
+
+    def test_callerinfo_classmethod(self):
+        self.callerinfo("class_classmethod", "fake_classmethod")
+
+    def test_callerinfo_staticmethod(self):
+        self.callerinfo("staticmethod", "fake_staticmethod")
+
+    def test_callerinfo_slots(self):
+        caller = stacklogger.callerinfo(self.frames["method"])
+        self.assertFalse(hasattr(caller, "__dict__"))
+        self.assertEqual(caller.lineno, self.frames["method"].f_lineno)
+
     def test_framefunc_function(self):
         self.framefunc("function", "fake_function")
 
@@ -179,13 +563,153 @@ class TestFrameFuncs(BaseTest):
         self.framefunc("classmethod", "FakeFrames.fake_classmethod")
 
     def test_framefunc_staticmethod(self):
-        self.framefunc("staticmethod", "fake_staticmethod")
+        self.framefunc("staticmethod", self.staticname)
 
     def test_framefunc_class_classmethod(self):
         self.framefunc("class_classmethod", "FakeFrames.fake_classmethod")
 
     def test_framefunc_class_staticmethod(self):
-        self.framefunc("class_staticmethod", "fake_staticmethod")
+        self.framefunc("class_staticmethod", self.staticname)
+
+    def test_framefunc_nested(self):
+        def nested():
+            return currentframe()
+        self.assertEqual(framefunc(nested()), "nested")
+
+    def test_framefunc_resolver(self):
+        self.assertEqual(stacklogger.usequalname,
+            hasattr(fake_function.__code__, "co_qualname") and self.usequalname)
+
+class TestFrameFuncsPrescan(TestFrameFuncs):
+    usequalname = False
+
+    def setUp(self):
+        TestFrameFuncs.setUp(self)
+        self.report = stacklogger.prescan([sys.modules[__name__]])
+
+    def tearDown(self):
+        stacklogger.definitions.clear()
+        TestFrameFuncs.tearDown(self)
+
+    @property
+    def staticname(self):
+        return "FakeFrames.fake_staticmethod"
+
+    def test_prescan_report(self):
+        self.assertEqual(self.report["modules"], 1)
+        self.assertTrue(self.report["classes"] >= 1)
+        self.assertTrue(self.report["functions"] >= 4)
+        self.assertTrue(self.report["seconds"] >= 0)
+
+    def test_prescan_definitions(self):
+        definitions = stacklogger.definitions
+        self.assertEqual(definitions[FakeFrames.fake_property.fget.__code__],
+            "FakeFrames.fake_property")
+        self.assertFalse(fake_function.__code__ in definitions)
+
+    def test_prescan_shared_wrapper(self):
+        definitions = stacklogger.definitions
+        wrapper = FakeDecoratedA.fake_foo.__code__
+        self.assertFalse(wrapper in definitions)
+        self.assertEqual(definitions[FakeDecoratedA.fake_foo.__wrapped__.__code__],
+            "FakeDecoratedA.fake_foo")
+        self.assertEqual(definitions[FakeDecoratedB.fake_bar.__wrapped__.__code__],
+            "FakeDecoratedB.fake_bar")
+        self.assertEqual(framefunc(FakeDecoratedA().fake_foo()), "wrapper")
+
+    def test_prescan_assigned_function(self):
+        self.assertFalse(fake_function.__code__ in stacklogger.definitions)
+        self.assertEqual(framefunc(self.frames["function"]), "fake_function")
+
+    def test_prescan_nested_class(self):
+        code = FakeOuter.FakeInner.fake_method.__code__
+        self.assertEqual(stacklogger.definitions[code],
+            "FakeOuter.FakeInner.fake_method")
+
+    def test_prescan_packages(self):
+        stacklogger.definitions.clear()
+        report = stacklogger.prescan([sys.modules[__name__], stacklogger],
+            packages=["stacklogger"])
+        self.assertEqual(report["modules"], 1)
+        self.assertFalse(
+            FakeFrames.fake_method.__code__ in stacklogger.definitions)
+
+    def test_prescan_packages_filenames(self):
+        stacklogger.filenames.pop("", None)
+        stacklogger.prescan([stacklogger], packages=["stacklogger"])
+        self.assertFalse("" in stacklogger.filenames)
+
+    def test_prescan_proxies(self):
+        module = types.ModuleType("fakeproxies")
+        exec("class FakeProxy(object):\n"
+            "    def __getattr__(self, name):\n"
+            "        raise RuntimeError('no context')\n"
+            "class FakeHolder(object):\n"
+            "    current = FakeProxy()\n"
+            "    def fake_method(self):\n"
+            "        pass\n", vars(module))
+        report = stacklogger.prescan([module])
+        self.assertEqual(report["skipped"], 1)
+        self.assertEqual(report["classes"], 2)
+        code = module.FakeHolder.fake_method.__code__
+        self.assertEqual(stacklogger.definitions[code], "FakeHolder.fake_method")
+
+class TestFrameFuncsHeuristic(TestFrameFuncs):
+    usequalname = False
+
+    def test_framefunc_cached(self):
+        stacklogger.qualnames.clear()
+        self.framefunc("method", "FakeFrames.fake_method")
+        self.framefunc("method", "FakeFrames.fake_method")
+        self.assertEqual(stacklogger.qualnames.misses, 1)
+        self.assertEqual(stacklogger.qualnames.hits, 1)
+
+@unittest.skipIf(stacklogger.speedups is None, "C speedups not built")
+class TestSpeedups(TestFrameFuncs):
+
+    def tearDown(self):
+        stacklogger.speedups = speedups
+        TestFrameFuncs.tearDown(self)
+
+    def pure(self, func, *args, **kwargs):
+        stacklogger.speedups = None
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stacklogger.speedups = speedups
+
+    def test_walk(self):
+        skip = stacklogger.SkipRules(files=[srcfile(__file__)])
+        for key, frame in self.frames.items():
+            for stacklevel in (1, 2, 3):
+                for rules in (None, skip):
+                    expected = self.pure(callingframe, frame, fast=True,
+                        skip=rules, stacklevel=stacklevel)
+                    result = callingframe(frame, fast=True, skip=rules,
+                        stacklevel=stacklevel)
+                    self.assertTrue(result is expected, key)
+
+    def test_walk_end(self):
+        self.assertEqual(callingframe(None, fast=True), None)
+        skip = stacklogger.SkipRules(modules=["tests"])
+        skip.skips = lambda frame: True
+        self.assertEqual(
+            callingframe(self.frames["function"], fast=True, skip=skip), None)
+
+    def test_walk_error(self):
+        skip = stacklogger.SkipRules()
+        def skips(frame):
+            raise ValueError()
+        skip.skips = skips
+        self.assertRaises(ValueError, callingframe, self.frames["function"],
+            fast=True, skip=skip)
+        self.assertRaises(TypeError, speedups.walk, object(), {}, skip)
+
+    def test_receiver(self):
+        for key, frame in self.frames.items():
+            self.assertTrue(stacklogger.receiver(frame) is
+                self.pure(stacklogger.receiver, frame), key)
+        self.assertRaises(TypeError, speedups.receiver, object())
 
 class TestStackLogger(BaseTest):
     
@@ -207,9 +731,21 @@ class TestStackLogger(BaseTest):
         self.handler.close()
         del(self.handler)
 
+    @property
+    def staticname(self):
+        if stacklogger.usequalname:
+            return "FakeFrames.fake_staticmethod"
+        return "fake_staticmethod"
+
     def getrecord(self, index=0):
         return getitem(self.handler.buffer, index, None)
 
+    def test_stacklogger_shared_filename(self):
+        fake_function()
+        self.fakes.fake_method()
+        first, second = self.getrecord(0), self.getrecord(1)
+        self.assertTrue(first.pathname is second.pathname)
+
     def test_stacklogger_function(self):
         fake_function()
         record = self.getrecord()
@@ -248,7 +784,7 @@ class TestStackLogger(BaseTest):
     def test_stacklogger_staticmethod(self):
         self.fakes.fake_staticmethod()
         record = self.getrecord()
-        self.assertEqual(record.funcName, "fake_staticmethod")
+        self.assertEqual(record.funcName, self.staticname)
         self.assertEqual(record.filename, "tests.py")
         self.assertNotEquals(record.lineno, 0)
 
@@ -264,4 +800,856 @@ class TestStackLogger(BaseTest):
         record = self.getrecord()
         self.assertEqual(record.filename, "tests.py")
         self.assertNotEquals(record.lineno, 0)
-        self.assertEqual(record.funcName, "fake_staticmethod")
+        self.assertEqual(record.funcName, self.staticname)
+
+class TestCallSites(TestStackLogger):
+
+    def setUp(self):
+        TestStackLogger.setUp(self)
+        self.log.callsites = LRUCache(maxsize=100)
+
+    def tearDown(self):
+        del(self.log.callsites)
+        TestStackLogger.tearDown(self)
+
+    def test_callsites_cached(self):
+        for _ in range(3):
+            self.fakes.fake_method()
+        self.assertEqual(len(self.handler.buffer), 3)
+        for record in self.handler.buffer:
+            self.assertEqual(record.funcName, "FakeFrames.fake_method")
+        stats = self.log.callsites.stats()
+        self.assertEqual(stats["size"], 1)
+        self.assertEqual(stats["hits"], 2)
+
+    def test_callsites_distinct(self):
+        fake_function()
+        self.fakes.fake_method()
+        self.assertEqual(len(self.log.callsites), 2)
+
+    def test_callsites_shared_modes(self):
+        plain = logging.getLogger("fakes.plain")
+        plain.callsites = self.log.callsites
+        self.log.lazy = True
+        try:
+            fake_wrapper(self.log)
+            fake_wrapper(plain)
+        finally:
+            del(self.log.lazy, plain.callsites)
+        self.assertTrue(isinstance(self.getrecord(0).funcName,
+            stacklogger.FuncName))
+        self.assertTrue(type(self.getrecord(1).funcName) is str)
+        self.assertEqual(len(self.log.callsites), 2)
+
+def fake_wrapper(log):
+    log.debug("in fake_wrapper")
+
+class TestStackLoggerSkip(TestStackLogger):
+
+    def setUp(self):
+        TestStackLogger.setUp(self)
+        self.log.skip = stacklogger.skipped.copy()
+
+    def tearDown(self):
+        del(self.log.skip)
+        TestStackLogger.tearDown(self)
+
+    def test_stacklogger_skip_wrapper(self):
+        fake_wrapper(self.log)
+        self.assertEqual(self.getrecord().funcName, "fake_wrapper")
+        self.log.skip.addmodule(__name__)
+        fake_wrapper(self.log)
+        self.assertNotEqual(self.getrecord(1).funcName, "fake_wrapper")
+
+class TestLazyStackLogger(TestStackLogger):
+
+    def setUp(self):
+        TestStackLogger.setUp(self)
+        self.log.lazy = True
+
+    def tearDown(self):
+        del(self.log.lazy)
+        TestStackLogger.tearDown(self)
+
+    def test_lazy_unresolved(self):
+        self.fakes.fake_method()
+        funcName = self.getrecord().funcName
+        self.assertTrue(isinstance(funcName, stacklogger.FuncName))
+        self.assertEqual(funcName.name, None)
+
+    def test_lazy_format(self):
+        self.fakes.fake_method()
+        record = self.getrecord()
+        formatter = logging.Formatter("%(funcName)s: %(message)s")
+        self.assertEqual(formatter.format(record),
+            "FakeFrames.fake_method: in FakeFrames.fake_method")
+        self.assertEqual(record.funcName.name, "FakeFrames.fake_method")
+        self.assertEqual("{0:>22}".format(record.funcName),
+            "FakeFrames.fake_method".rjust(22))
+
+    def test_lazy_pickle(self):
+        self.fakes.fake_method()
+        funcName = pickle.loads(pickle.dumps(self.getrecord().funcName))
+        self.assertEqual(type(funcName), str)
+        self.assertEqual(funcName, "FakeFrames.fake_method")
+
+class TestCoroutines(TestStackLogger):
+
+    def setUp(self):
+        TestStackLogger.setUp(self)
+        self.log.coroutines = True
+        self.oldusequalname = stacklogger.usequalname
+        # Make sure coroutine names come from the task.
+        stacklogger.usequalname = False
+
+    def tearDown(self):
+        stacklogger.usequalname = self.oldusequalname
+        del(self.log.coroutines)
+        TestStackLogger.tearDown(self)
+
+    def runtask(self, coro, name):
+        async def main():
+            task = asyncio.ensure_future(coro)
+            task.set_name(name)
+            await task
+        asyncio.run(main())
+
+    def test_coroutines_task(self):
+        self.runtask(FakeTasks().fake_coroutine(), "fake-task")
+        record = self.getrecord()
+        self.assertEqual(record.taskName, "fake-task")
+        self.assertEqual(record.coroName, "FakeTasks.fake_coroutine")
+        self.assertEqual(record.funcName, "FakeTasks.fake_coroutine")
+
+    def test_coroutines_awaited(self):
+        self.runtask(FakeTasks().fake_awaiter(), "fake-awaiter")
+        record = self.getrecord()
+        self.assertEqual(record.taskName, "fake-awaiter")
+        self.assertEqual(record.coroName, "FakeTasks.fake_awaiter")
+
+    def test_coroutines_cached(self):
+        stacklogger.tasknames.clear()
+        async def main():
+            for _ in range(3):
+                stacklogger.taskinfo()
+            return len(stacklogger.tasknames)
+        self.assertEqual(asyncio.run(main()), 1)
+
+    def test_coroutines_unnamed(self):
+        # Tasks before Python 3.8 have no get_name() or get_coro().
+        class FakeTask(object):
+            _coro = FakeTasks().fake_coroutine()
+        task = FakeTask()
+        saved = asyncio.current_task
+        asyncio.current_task = lambda: task
+        try:
+            info = stacklogger.taskinfo()
+        finally:
+            asyncio.current_task = saved
+            task._coro.close()
+        self.assertEqual(info[:2], (None, "FakeTasks.fake_coroutine"))
+
+    def test_coroutines_notask(self):
+        fake_function()
+        record = self.getrecord()
+        self.assertEqual(record.taskName, None)
+        self.assertEqual(record.coroName, None)
+
+class TestCaptureArgs(TestStackLogger):
+
+    def setUp(self):
+        TestStackLogger.setUp(self)
+        self.log.captureargs = True
+
+    def tearDown(self):
+        del(self.log.captureargs)
+        TestStackLogger.tearDown(self)
+
+    def test_argplan(self):
+        plan = stacklogger.argplan(fake_arguments.__code__)
+        self.assertEqual(plan,
+            (("a", ""), ("b", ""), ("args", "*"), ("kwargs", "**")))
+        self.assertTrue(stacklogger.argplan(fake_arguments.__code__) is plan)
+
+    def test_captureargs(self):
+        fake_arguments(1, "x", 3, c=4)
+        funcArgs = self.getrecord().funcArgs
+        self.assertEqual(funcArgs.text, None)
+        self.assertEqual(str(funcArgs), "a=1, b='x', *args=(3,), **kwargs={'c': 4}")
+
+    def test_captureargs_method(self):
+        self.fakes.fake_method()
+        self.assertEqual(self.getrecord().funcArgs.items(),
+            [("self", self.fakes)])
+
+    def test_captureargs_failed(self):
+        def fake_failing(request):
+            self.log.debug("clashing", extra={"message": "clash"})
+        request = FakeRequest()
+        ref = weakref.ref(request)
+        try:
+            fake_failing(request)
+        except KeyError:
+            pass
+        else:
+            self.fail("makeRecord() didn't raise")
+        del(request)
+        gc.collect()
+        self.assertEqual(ref(), None)
+        self.assertEqual(stacklogger.pending.funcArgs, None)
+
+    def test_captureargs_held(self):
+        request = FakeRequest()
+        ref = weakref.ref(request)
+        fake_arguments(request, [request], "x" * 100)
+        funcArgs = self.getrecord().funcArgs
+        self.assertEqual(funcArgs.items()[0], ("a", request))
+        del(request)
+        gc.collect()
+        self.assertEqual(ref(), None)
+        text = str(funcArgs)
+        self.assertTrue(text.startswith("a=<gone>, b=[<tests.FakeRequest"), text)
+        self.assertTrue(text.endswith("xxx',), **kwargs={}"), text)
+        self.assertTrue(len(text) < 200, text)
+
+    def test_captureargs_none(self):
+        fake_function()
+        self.assertEqual(str(self.getrecord().funcArgs), "")
+
+    def test_captureargs_capped(self):
+        fake_arguments("x" * 10000)
+        self.assertTrue(len(str(self.getrecord().funcArgs)) < 200)
+
+    def test_captureargs_format(self):
+        fake_arguments(1)
+        formatter = logging.Formatter("%(funcName)s(%(funcArgs)s)")
+        self.assertEqual(formatter.format(self.getrecord()),
+            "fake_arguments(a=1, b=2, *args=(), **kwargs={})")
+
+class FakeSampler(stacklogger.Sampler):
+
+    def __init__(self, decisions):
+        stacklogger.Sampler.__init__(self)
+        self.decisions = list(decisions)
+
+    def keep(self, key):
+        return self.decisions.pop(0)
+
+class TestSampler(TestStackLogger):
+
+    def tearDown(self):
+        self.log.__dict__.pop("sampler", None)
+        TestStackLogger.tearDown(self)
+
+    def test_sampler_drops(self):
+        self.log.sampler = FakeSampler([True, False, True])
+        for _ in range(3):
+            fake_function()
+        self.assertEqual(len(self.handler.buffer), 2)
+        stats = self.log.sampler.stats()
+        self.assertEqual((stats["kept"], stats["dropped"]), (2, 1))
+        (site, counts), = stats["sites"].items()
+        self.assertModuleFileIs(site[0], "tests.py")
+        self.assertEqual(site[2], "fake_function")
+        self.assertEqual(counts, (2, 1))
+
+    def test_sampler_before_findcaller(self):
+        self.log.sampler = FakeSampler([False])
+        calls = []
+        self.log.findCaller = lambda *args: calls.append(args)
+        try:
+            fake_function()
+        finally:
+            del(self.log.findCaller)
+        self.assertEqual(calls, [])
+
+    def test_sampler_random(self):
+        self.log.sampler = stacklogger.RandomSampler(0)
+        fake_function()
+        self.log.sampler = stacklogger.RandomSampler(1)
+        fake_function()
+        self.assertEqual(len(self.handler.buffer), 1)
+
+    def test_sampler_tokenbucket(self):
+        sampler = stacklogger.TokenBucketSampler(rate=0.001, burst=2)
+        self.log.sampler = sampler
+        for _ in range(5):
+            fake_function()
+        self.fakes.fake_method()
+        self.assertEqual(len(self.handler.buffer), 3)
+        self.assertEqual(sampler.stats()["dropped"], 3)
+
+class TestCallPath(TestStackLogger):
+
+    def setUp(self):
+        TestStackLogger.setUp(self)
+        self.log.callpath = 3
+
+    def tearDown(self):
+        del(self.log.callpath)
+        TestStackLogger.tearDown(self)
+
+    def test_callpath(self):
+        FakeCallers().outer()
+        callPath = self.getrecord().callPath
+        self.assertEqual(callPath.text, None)
+        self.assertEqual(str(callPath),
+            "FakeCallers.outer > FakeCallers.inner > fake_function")
+
+    def test_callpath_depth(self):
+        self.log.callpath = 1
+        FakeCallers().outer()
+        self.assertEqual(str(self.getrecord().callPath), "fake_function")
+
+    def test_callpath_interned(self):
+        fakes = FakeCallers()
+        fakes.outer()
+        fakes.outer()
+        first, second = self.getrecord(0), self.getrecord(1)
+        self.assertTrue(first.callPath is second.callPath)
+
+    def test_callpath_format(self):
+        FakeCallers().outer()
+        formatter = logging.Formatter("%(callPath)s: %(message)s")
+        self.assertEqual(formatter.format(self.getrecord()),
+            "FakeCallers.outer > FakeCallers.inner > fake_function: "
+            "in fake_function")
+
+class TestSiteQueue(TestStackLogger):
+
+    def setUp(self):
+        TestStackLogger.setUp(self)
+        self.log.removeHandler(self.handler)
+        self.queue = queue.Queue()
+        self.queuehandler = stacklogger.SiteQueueHandler(self.queue)
+        self.log.addHandler(self.queuehandler)
+        self.log.lazy = True
+        self.listener = stacklogger.SiteQueueListener(self.queue, self.handler)
+        self.listener.start()
+
+    def tearDown(self):
+        self.listener.stop()
+        self.log.removeHandler(self.queuehandler)
+        self.log.addHandler(self.handler)
+        del(self.log.lazy)
+        TestStackLogger.tearDown(self)
+
+    def getrecord(self, index=0):
+        self.listener.stop()
+        self.listener.start()
+        return TestStackLogger.getrecord(self, index)
+
+    def test_sitequeue_payload(self):
+        fake_function()
+        fake_function()
+        record = self.getrecord(1)
+        plain = logging.handlers.QueueHandler(self.queue).prepare(record)
+        self.queuehandler.prepare(record)
+        sited = self.queuehandler.prepare(record)
+        self.assertFalse(hasattr(sited, "siteDef"))
+        self.assertTrue(len(pickle.dumps(sited)) < len(pickle.dumps(plain)))
+
+    def test_sitequeue_definitions(self):
+        records = []
+        prepare = self.queuehandler.prepare
+        self.queuehandler.prepare = lambda record: records.append(
+            prepare(record)) or records[-1]
+        try:
+            for _ in range(3):
+                fake_function()
+            self.fakes.fake_method()
+        finally:
+            del(self.queuehandler.prepare)
+        self.assertEqual([hasattr(record, "siteDef") for record in records],
+            [True, False, False, True])
+        sites = [record.site for record in records]
+        self.assertEqual(sites[:3], [sites[0]] * 3)
+        self.assertNotEqual(sites[3], sites[0])
+        for record in records:
+            self.assertFalse(hasattr(record, "funcName"))
+            self.assertFalse(hasattr(record, "pathname"))
+        self.assertEqual(records[0].siteDef[2], "fake_function")
+        pickle.dumps(records[0])
+        self.assertEqual(self.getrecord(3).funcName, "FakeFrames.fake_method")
+
+    def test_sitequeue_shared(self):
+        other = logging.getLogger("fakes.other")
+        other.propagate = False
+        otherhandler = stacklogger.SiteQueueHandler(self.queue)
+        other.addHandler(otherhandler)
+        try:
+            fake_function()
+            other.debug("in other")
+            fake_function()
+        finally:
+            other.removeHandler(otherhandler)
+        names = [self.getrecord(i).funcName for i in range(3)]
+        self.assertEqual(names[0::2], ["fake_function", "fake_function"])
+        self.assertTrue(names[1].endswith("test_sitequeue_shared"))
+
+    def test_sitequeue_full(self):
+        full = queue.Queue(1)
+        handler = stacklogger.SiteQueueHandler(full)
+        handler.handleError = lambda record: None
+        self.log.removeHandler(self.queuehandler)
+        self.log.addHandler(handler)
+        try:
+            full.put(None)
+            fake_function()
+            full.get()
+            fake_function()
+        finally:
+            self.log.removeHandler(handler)
+            self.log.addHandler(self.queuehandler)
+        listener = stacklogger.SiteQueueListener(full)
+        record = listener.prepare(full.get_nowait())
+        self.assertEqual(record.funcName, "fake_function")
+        self.assertEqual(record.filename, "tests.py")
+
+    def test_sitequeue_resend(self):
+        fake_function()
+        self.assertEqual(self.getrecord().funcName, "fake_function")
+        self.listener.stop()
+        self.listener = stacklogger.SiteQueueListener(self.queue, self.handler)
+        self.listener.start()
+        self.queuehandler.resend()
+        fake_function()
+        self.assertEqual(self.getrecord(1).funcName, "fake_function")
+
+class TestInstruments(TestStackLogger):
+
+    def setUp(self):
+        TestStackLogger.setUp(self)
+        self.instruments = stacklogger.instrument(every=2)
+
+    def tearDown(self):
+        stacklogger.instrument(None)
+        TestStackLogger.tearDown(self)
+
+    def test_instruments_sampled(self):
+        for _ in range(4):
+            fake_function()
+        snapshot = self.instruments.snapshot()
+        self.assertEqual(snapshot["records"], 4)
+        self.assertEqual(snapshot["sampled"], 2)
+        self.assertTrue(snapshot["frames_per_record"] >= 3)
+        for phase in ("callingframe", "framefunc"):
+            timing = snapshot["timings"][phase]
+            self.assertEqual(timing["count"], 2)
+            self.assertEqual(timing["buckets"][-1][1], 2)
+        self.assertTrue("qualnames" in snapshot["caches"])
+
+    def test_instruments_fallbacks(self):
+        saved = stacklogger.usequalname
+        stacklogger.usequalname = False
+        try:
+            stacklogger.classfunc(fake_function.__code__, FakeFrames)
+        finally:
+            stacklogger.usequalname = saved
+        self.assertEqual(self.instruments.fallbacks, 1)
+
+    def test_instruments_prometheus(self):
+        fake_function()
+        fake_function()
+        text = self.instruments.prometheus()
+        self.assertTrue("stacklogger_records_total 2\n" in text)
+        self.assertTrue('stacklogger_seconds_count{phase="framefunc"} 1\n'
+            in text)
+        self.assertTrue('le="+Inf"' in text)
+
+    def test_instruments_prometheus_families(self):
+        fake_function()
+        families = []
+        for line in self.instruments.prometheus().splitlines():
+            if line.startswith("# TYPE "):
+                families.append(line.split()[2])
+                continue
+            name = line.split("{")[0].split()[0]
+            family = families[-1]
+            self.assertTrue(name == family or
+                name.rsplit("_", 1)[0] == family, (name, family))
+        self.assertEqual(len(families), len(set(families)))
+        self.assertTrue("stacklogger_cache_size" in families)
+
+    def test_instruments_write(self):
+        path = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(path, "stacklogger.prom")
+            self.instruments.write(fname)
+            fake_function()
+            self.instruments.write(fname)
+            with open(fname) as f:
+                self.assertEqual(f.read(), self.instruments.prometheus())
+            self.assertEqual(os.listdir(path), ["stacklogger.prom"])
+        finally:
+            shutil.rmtree(path)
+
+    def test_instruments_caches(self):
+        self.log.callsites = LRUCache(maxsize=10)
+        try:
+            instruments = stacklogger.instrument(every=2,
+                caches={"fakes_callsites": self.log.callsites})
+            fake_function()
+            fake_function()
+            snapshot = instruments.snapshot()
+            self.assertEqual(snapshot["caches"]["fakes_callsites"]["hits"], 1)
+            self.assertTrue('cache="fakes_callsites"' in
+                instruments.prometheus())
+        finally:
+            del(self.log.callsites)
+
+class TestStackLevel(TestStackLogger):
+
+    def tearDown(self):
+        FakeLevels.level = 1
+        TestStackLogger.tearDown(self)
+
+    def stacklevel(self, call, name):
+        fakes = FakeLevels()
+        expected = ["fake_level2", "fake_level1", name]
+        for level in (1, 2, 3):
+            FakeLevels.level = level
+            call(fakes)
+            record = self.getrecord(level - 1)
+            self.assertEqual(record.funcName, expected[level - 1])
+            self.assertEqual(record.filename, "tests.py")
+
+    def test_stacklevel_method(self):
+        self.stacklevel(lambda fakes: fakes.fake_method(),
+            "FakeLevels.fake_method")
+
+    def test_stacklevel_property(self):
+        self.stacklevel(lambda fakes: fakes.fake_property,
+            "FakeLevels.fake_property")
+
+    def test_stacklevel_classmethod(self):
+        self.stacklevel(lambda fakes: fakes.fake_classmethod(),
+            "FakeLevels.fake_classmethod")
+
+    def test_stacklevel_class_classmethod(self):
+        self.stacklevel(lambda fakes: FakeLevels.fake_classmethod(),
+            "FakeLevels.fake_classmethod")
+
+    def test_stacklevel_staticmethod(self):
+        self.stacklevel(lambda fakes: fakes.fake_staticmethod(),
+            self.staticname.replace("FakeFrames", "FakeLevels"))
+
+    def test_stacklevel_function(self):
+        self.stacklevel(lambda fakes: fake_level_function(),
+            "fake_level_function")
+
+    def test_stacklevel_lambda(self):
+        self.stacklevel(lambda fakes: fake_level_lambda(), "<lambda>")
+
+    def test_stacklevel_too_deep(self):
+        plain = logging.Logger("plain")
+        handler = logging.handlers.BufferingHandler(10)
+        plain.addHandler(handler)
+        plain.debug("too deep", stacklevel=10000)
+        self.log.debug("too deep", stacklevel=10000)
+        expected, record = handler.buffer[0], self.getrecord()
+        self.assertNotEqual(record.lineno, 0)
+        self.assertEqual(record.pathname, stacklogger.normfile(expected.pathname))
+        self.assertEqual(record.lineno, expected.lineno)
+
+        outermost = frame = currentframe()
+        while frame is not None:
+            outermost, frame = frame, frame.f_back
+        for fast in (True, False):
+            result = callingframe(currentframe(), fast=fast, stacklevel=10000)
+            self.assertTrue((result if fast else result[0]) is outermost)
+
+    def test_stack_info(self):
+        self.log.debug("with stack", stack_info=True)
+        self.fakes.fake_method()
+        stack_info = self.getrecord(0).stack_info
+        self.assertTrue(stack_info.startswith("Stack (most recent call last):"))
+        self.assertTrue("in test_stack_info\n" in stack_info)
+        self.assertEqual(self.getrecord(1).stack_info, None)
+
+fakewrapper = {}
+exec(compile("def fake_skipped(log):\n    log.debug('in fake_skipped')\n",
+    "fakewrapper.py", "exec"), fakewrapper)
+
+def fake_skipped_caller(log):
+    fakewrapper["fake_skipped"](log)
+
+class TestDepths(TestStackLogger):
+
+    def setUp(self):
+        TestStackLogger.setUp(self)
+        self.log.depths = {}
+        self.log.skip = stacklogger.skipped.copy()
+        self.log.skip.addfile("fakewrapper.py")
+
+    def tearDown(self):
+        del(self.log.depths, self.log.skip)
+        TestStackLogger.tearDown(self)
+
+    def test_depths_learned(self):
+        debug = logging.Logger.debug.__code__
+        for _ in range(3):
+            fake_function()
+            self.assertEqual(self.log.depths,
+                {(self.log.skip, debug): ((1, debug),)})
+        for record in self.handler.buffer:
+            self.assertEqual(record.funcName, "fake_function")
+
+    def test_depths_wrapper(self):
+        debug = logging.Logger.debug.__code__
+        skipped = fakewrapper["fake_skipped"].__code__
+        for _ in range(2):
+            fake_function()
+            fake_skipped_caller(self.log)
+        self.assertEqual(sorted(self.log.depths[self.log.skip, debug]),
+            sorted([(1, debug), (2, skipped)]))
+        names = [r.funcName for r in self.handler.buffer]
+        self.assertEqual(names, ["fake_function", "fake_skipped_caller"] * 2)
+
+    def test_depths_sampler(self):
+        self.log.sampler = stacklogger.RandomSampler(1.0)
+        try:
+            fake_function()
+            fake_function()
+        finally:
+            del(self.log.sampler)
+        self.assertEqual(self.getrecord(1).funcName, "fake_function")
+
+    def test_depths_shared(self):
+        plain = logging.getLogger("fakes.plain")
+        plain.depths = self.log.depths
+        try:
+            fake_skipped_caller(self.log)
+            fake_skipped_caller(plain)
+            fake_skipped_caller(self.log)
+        finally:
+            del(plain.depths)
+        names = [r.funcName for r in self.handler.buffer]
+        self.assertEqual(names,
+            ["fake_skipped_caller", "fake_skipped", "fake_skipped_caller"])
+
+class TestJSONFormatter(TestStackLogger):
+
+    def setUp(self):
+        TestStackLogger.setUp(self)
+        self.formatter = stacklogger.JSONFormatter(fields=["user"])
+
+    def format(self, index=0):
+        return json.loads(self.formatter.format(self.getrecord(index)))
+
+    def test_json(self):
+        self.fakes.fake_method()
+        record, result = self.getrecord(), self.format()
+        self.assertEqual(result, {
+            "created": record.created,
+            "levelname": "DEBUG",
+            "name": "fakes",
+            "message": "in FakeFrames.fake_method",
+            "funcName": "FakeFrames.fake_method",
+            "pathname": record.pathname,
+            "lineno": record.lineno,
+        })
+
+    def test_json_sites(self):
+        for _ in range(3):
+            self.fakes.fake_method()
+        fake_function()
+        for index in range(4):
+            self.format(index)
+        stats = self.formatter.sites.stats()
+        self.assertEqual(stats["size"], 2)
+        self.assertEqual(stats["hits"], 2)
+
+    def test_json_lazy(self):
+        self.log.lazy = True
+        try:
+            self.fakes.fake_method()
+        finally:
+            del(self.log.lazy)
+        self.assertEqual(self.format()["funcName"], "FakeFrames.fake_method")
+
+    def test_json_context(self):
+        self.log.captureargs = True
+        try:
+            fake_arguments(1, "é\n")
+        finally:
+            del(self.log.captureargs)
+        self.assertEqual(self.format()["funcArgs"],
+            "a=1, b='é\\n', *args=(), **kwargs={}")
+
+    def test_json_fields(self):
+        self.log.debug("with %s", "extra", extra={"user": {"id": 1}})
+        result = self.format()
+        self.assertEqual(result["message"], "with extra")
+        self.assertEqual(result["user"], {"id": 1})
+
+    def test_json_exception(self):
+        try:
+            raise ValueError("oops")
+        except ValueError:
+            self.log.exception("failed")
+        result = self.format()
+        self.assertTrue(result["exc_info"].endswith("ValueError: oops"))
+        self.assertFalse("stack_info" in result)
+
+class FakeRequest(object):
+
+    def __init__(self):
+        self.payload = bytearray(1 << 20)
+
+    def handle(self):
+        log = logging.getLogger("fakes")
+        log.debug("in FakeRequest.handle")
+
+def fake_request():
+    request = FakeRequest()
+    request.handle()
+    return weakref.ref(request)
+
+def countframes():
+    gc.collect()
+    return len([o for o in gc.get_objects() if isinstance(o, types.FrameType)])
+
+class TestMemory(TestStackLogger):
+    options = [
+        {},
+        {"lazy": True},
+        {"callsites": LRUCache()},
+        {"callpath": 5},
+        {"depths": {}},
+        {"sampler": stacklogger.RandomSampler(1.0)},
+        {"coroutines": True},
+        {"captureargs": True},
+    ]
+
+    def setUp(self):
+        TestStackLogger.setUp(self)
+        self.oldusequalname = stacklogger.usequalname
+        self.oldspeedups = stacklogger.speedups
+
+    def tearDown(self):
+        stacklogger.usequalname = self.oldusequalname
+        stacklogger.speedups = self.oldspeedups
+        for name in set().union(*self.options):
+            self.log.__dict__.pop(name, None)
+        TestStackLogger.tearDown(self)
+
+    def configurations(self):
+        for usequalname in set([False, self.oldusequalname]):
+            for usespeedups in set([None, self.oldspeedups]):
+                for options in self.options:
+                    stacklogger.usequalname = usequalname
+                    stacklogger.speedups = usespeedups
+                    self.log.__dict__.update(options)
+                    yield (usequalname, usespeedups, options)
+                    for name in options:
+                        del(self.log.__dict__[name])
+
+    def test_memory_frames(self):
+        for config in self.configurations():
+            for _ in range(3):
+                self.fakes.fake_method()
+            before = countframes()
+            for _ in range(10):
+                self.fakes.fake_method()
+                fake_function()
+            self.assertEqual(countframes(), before, config)
+
+    def test_memory_request(self):
+        # Records must not keep the caller's locals alive.
+        for config in self.configurations():
+            self.handler.buffer = []
+            request = fake_request()
+            self.assertEqual(self.getrecord().funcName,
+                "FakeRequest.handle")
+            self.assertEqual(request(), None, config)
+
+    def test_memory_allocations(self):
+        # Test runners may add handlers that keep records.
+        handlers, self.log.handlers = self.log.handlers, [self.handler]
+        self.addCleanup(setattr, self.log, "handlers", handlers)
+        self.handler.capacity = 0
+        for config in self.configurations():
+            for _ in range(10):
+                self.fakes.fake_method()
+            tracemalloc.start()
+            try:
+                for _ in range(100):
+                    self.fakes.fake_method()
+                self.handler.buffer = []
+                current, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            self.assertTrue(current < 2048, (current, config))
+            self.assertTrue(peak < 16384, (peak, config))
+
+class TestResolve(TestStackLogger):
+
+    def setUp(self):
+        TestStackLogger.setUp(self)
+        self.handler.capacity = 1000
+        self.calls = []
+        self.oldcodefunc = stacklogger.codefunc
+        def codefunc(code, cls=None):
+            self.calls.append(code)
+            return self.oldcodefunc(code, cls)
+        stacklogger.codefunc = codefunc
+
+    def tearDown(self):
+        stacklogger.codefunc = self.oldcodefunc
+        TestStackLogger.tearDown(self)
+
+    def test_resolve_records(self):
+        self.log.lazy = True
+        try:
+            for _ in range(50):
+                self.fakes.fake_method()
+                fake_function()
+        finally:
+            del(self.log.lazy)
+        del(self.calls[:])
+        records = self.handler.buffer
+        results = stacklogger.resolve(records)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(len(results), 100)
+        self.assertEqual([r[2] for r in results[:2]],
+            ["FakeFrames.fake_method", "fake_function"])
+        self.assertEqual(results[0][:2], (records[0].pathname, records[0].lineno))
+        self.assertEqual(records[0].funcName.name, "FakeFrames.fake_method")
+        str(records[2].funcName)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_resolve_plain_records(self):
+        pathname = os.path.relpath(srcfile(__file__)) + "c"
+        record = logging.LogRecord("plain", logging.DEBUG, pathname, 3,
+            "message", (), None, "fake_function")
+        results = stacklogger.resolve([record, record])
+        self.assertEqual(results[0], (srcfile(__file__), 3, "fake_function"))
+        self.assertTrue(results[0][0] is results[1][0])
+
+    def test_resolve_unknown_records(self):
+        record = logging.LogRecord("plain", logging.DEBUG, "(unknown file)", 0,
+            "message", (), None, "(unknown function)")
+        self.assertEqual(stacklogger.resolve([record]),
+            [("(unknown file)", 0, "(unknown function)")])
+
+    def test_resolve_frames(self):
+        frames = [self.fakes.fake_method(), fake_function()] * 10
+        del(self.calls[:])
+        results = stacklogger.resolve(frames)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(results[0][0], srcfile(__file__))
+        self.assertEqual(results[0][1], frames[0].f_lineno)
+        self.assertEqual(results[0][2], "FakeFrames.fake_method")
+        self.assertTrue(results[0] is results[2])
+
+    def test_resolve_keys(self):
+        code = fake_function.__code__
+        method = FakeFrames.fake_method.__code__
+        info = stacklogger.CallerInfo(method, 3, cls=FakeFrames)
+        results = stacklogger.resolve([(code, 1), (code, 2), (code, 1),
+            (method, 3, FakeFrames), info])
+        self.assertEqual([r[1:] for r in results], [(1, "fake_function"),
+            (2, "fake_function"), (1, "fake_function"),
+            (3, "FakeFrames.fake_method"), (3, "FakeFrames.fake_method")])
+        self.assertEqual(len(self.calls), 2)